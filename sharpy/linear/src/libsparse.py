@@ -13,7 +13,10 @@ Classes:
 scipy.sparse matrices are wrapped so as to ensure compatibility with numpy arrays
 upon conversion to dense.
 - csc_matrix: this is a wrapper of scipy.csc_matrix.
-- SupportedTypes: types supported for operations
+- lu_factorisation: LU factorisation of a dense/sparse matrix, reusable over
+multiple right-hand-sides.
+- SupportedTypes: types supported for operations (SupportedTypesSet, as a
+frozenset, for exact type membership checks)
 - WarningTypes: due to some bugs in scipy (v.1.1.0), sum (+) operations between
 np.ndarray and scipy.sparse matrices can result in numpy.matrixlib.defmatrix.matrix
 types. This list contains such undesired types that can result from dense/sparse
@@ -22,8 +25,11 @@ operations and raises a warning if required.
 
 Methods:
 - dot: handles matrix dot products across different types.
+- triple: triple product CT*X*C without allocating X*C.
 - solve: solves linear systems Ax=b with A and b dense, sparse or mixed.
+- factorize: factorises A once for repeated solutions of Ax=b.
 - dense: convert matrix to numpy array
+- auto: store matrix as dense or sparse according to its density
 
 Warning:
 - only sparse types into SupportedTypes are supported!
@@ -32,12 +38,33 @@ To Do:
 - move these methods into an algebra module?
 '''
 
+import os
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import scipy.linalg as scalg
 import scipy.sparse as sparse
 import scipy.sparse.linalg as spalg
 import scipy.sparse.sputils as sputils
 
+try:
+	from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+	cholmod_cholesky = None
+
+try:
+	from numba import njit
+except ImportError:
+	njit = None
+
+try:
+	import cupy
+	import cupyx.scipy.sparse as cpsparse
+	import cupyx.scipy.sparse.linalg as cpspalg
+except ImportError:
+	cupy = None
+
 # --------------------------------------------------------------------- Classes
 
 class csc_matrix(sparse.csc_matrix):
@@ -48,6 +75,19 @@ class csc_matrix(sparse.csc_matrix):
 		- todense
 		- _add_dense
 
+	Identity matrices built via eye_as are flagged so that dot can skip the
+	product. Similarly, a CSR copy of the matrix is cached on first use (_csr)
+	and used by dot for products with dense matrices/vectors, while the
+	transpose (_T, a CSR view sharing the data arrays) is cached for products
+	where the matrix is the right operand. The flag and the caches are reset
+	by any in-place modification (__setitem__, setdiag, *=, /=), but not if
+	the data array is directly overwritten.
+
+	Being a subclass, the wrapper is accepted by all scipy.sparse routines and
+	is preserved by arithmetic, slicing and products between csc matrices,
+	which scipy builds through self.__class__. The transpose is instead a
+	scipy.sparse.csr_matrix.
+
 	Warning: this format is memory inefficient to allocate new sparse matrices.
 	Consider using:
 	- scipy.sparse.lil_matrix, which supports slicing, or
@@ -57,6 +97,47 @@ class csc_matrix(sparse.csc_matrix):
 
 	def __init__(self,arg1, shape=None, dtype=None, copy=False):
 		super().__init__(arg1, shape=shape, dtype=dtype, copy=copy)
+		# use 32 bit indices whenever possible to reduce the memory traffic
+		if self.indices.dtype==np.int64 and max(self.shape)<2**31 and self.nnz<2**31:
+			self.indices=self.indices.astype(np.int32)
+			self.indptr=self.indptr.astype(np.int32)
+		self._clear_cache()
+
+	def _clear_cache(self):
+		''' Reset any information derived from the matrix content. '''
+		self._libsparse_identity=False
+		self._csr_cache=None
+		self._T_cache=None
+
+	@property
+	def _csr(self):
+		''' CSR copy of the matrix, computed on first access and cached. '''
+		if getattr(self,'_csr_cache',None) is None:
+			self._csr_cache=self.tocsr()
+		return self._csr_cache
+
+	@property
+	def _T(self):
+		''' Transpose of the matrix (CSR format), cached on first access. '''
+		if getattr(self,'_T_cache',None) is None:
+			self._T_cache=self.transpose()
+		return self._T_cache
+
+	def __setitem__(self, key, x):
+		self._clear_cache()
+		super().__setitem__(key, x)
+
+	def setdiag(self, values, k=0):
+		self._clear_cache()
+		super().setdiag(values, k=k)
+
+	def __imul__(self, other):
+		self._clear_cache()
+		return super().__imul__(other)
+
+	def __itruediv__(self, other):
+		self._clear_cache()
+		return super().__itruediv__(other)
 
 	def todense(self):
 		''' As per scipy.spmatrix.todense but returns a numpy.ndarray. '''
@@ -74,13 +155,131 @@ class csc_matrix(sparse.csc_matrix):
 		return result #np.matrix(result, copy=False)
 
 
+class lu_factorisation():
+	'''
+	LU factorisation of a square matrix A, stored either as numpy.ndarray or
+	as csc_matrix. The factorisation is computed once at allocation through:
+		- scipy.linalg.lu_factor, if A is dense
+		- scipy.sparse.linalg.splu, if A is sparse
+	and the solve method can then be called for any number of right-hand-sides.
+
+	Use this in place of libsparse.solve when A does not change across
+	repeated solutions: A is factorised once outside the loop, and only the
+	triangular solutions are performed inside it.
+
+	If backend='gpu' and A is sparse, the factors are computed on the CPU but
+	uploaded once to the GPU (requires cupy), where the triangular solutions
+	are performed. This only pays off if the cost of transferring the factors
+	is amortised over many right-hand-sides.
+	'''
+
+	def __init__(self,A,backend='cpu'):
+		assert A.shape[0]==A.shape[1], 'Not a square matrix!'
+		assert backend in ['cpu','gpu'], "backend must be 'cpu' or 'gpu'"
+		self.shape=A.shape
+		self.is_sparse=isinstance(A,csc_matrix)
+		self.backend=backend if self.is_sparse else 'cpu'
+		if self.is_sparse:
+			self.lu=spalg.splu(A)
+		else:
+			self.lu=scalg.lu_factor(A,check_finite=False)
+
+		if self.backend=='gpu':
+			assert cupy is not None, 'cupy is required for backend=gpu'
+			self.L_gpu=cpsparse.csr_matrix(self.lu.L.tocsr())
+			self.U_gpu=cpsparse.csr_matrix(self.lu.U.tocsr())
+			self.perm_r_gpu=cupy.asarray(self.lu.perm_r)
+			self.perm_c_gpu=cupy.asarray(self.lu.perm_c)
+
+	def solve(self,b):
+		''' Solve A x = b. If b is sparse, this is converted to dense. '''
+		b=dense(b)
+		if self.backend=='gpu':
+			return self._solve_gpu(b)
+		if self.is_sparse:
+			return self.lu.solve(b)
+		return scalg.lu_solve(self.lu,b,check_finite=False)
+
+	def _solve_gpu(self,b):
+		''' Triangular solutions L U x = Pr b on the GPU. '''
+		b_gpu=cupy.asarray(b)
+		y=cupy.empty_like(b_gpu)
+		y[self.perm_r_gpu]=b_gpu
+		y=cpspalg.spsolve_triangular(self.L_gpu,y,lower=True)
+		y=cpspalg.spsolve_triangular(self.U_gpu,y,lower=False)
+		return cupy.asnumpy(y[self.perm_c_gpu])
+
+
 SupportedTypes=[np.ndarray,csc_matrix]
+SupportedTypesSet=frozenset(SupportedTypes) # for exact type lookups
 WarningTypes=[np.matrixlib.defmatrix.matrix]
 
 
 # --------------------------------------------------------------------- Methods
 
 
+if njit is not None:
+	@njit(cache=True)
+	def _csc_matvec(indptr, indices, data, x, y):
+		''' Compiled y += A x, with A in CSC format and x a vector. '''
+		for jj in range(len(indptr)-1):
+			xj=x[jj]
+			for kk in range(indptr[jj],indptr[jj+1]):
+				y[indices[kk]]+=data[kk]*xj
+else:
+	_csc_matvec = None
+
+
+# sparse x dense products are split across threads only above these sizes
+PARALLEL_SPMM_MIN_COLS=32
+PARALLEL_SPMM_MIN_NNZ=100000
+# number of threads used for these products (set to 1 to disable them, e.g. if
+# the caller is already running multi-threaded BLAS/OpenMP code)
+PARALLEL_SPMM_MAX_THREADS=min(os.cpu_count() or 1,8)
+
+_spmm_pool=None # (number of workers, executor)
+_spmm_pool_lock=threading.Lock()
+
+
+def _spmm_executor():
+	'''
+	Thread pool shared by all the calls to _parallel_spmm. This is created on
+	first use with PARALLEL_SPMM_MAX_THREADS workers, and re-created only if
+	PARALLEL_SPMM_MAX_THREADS is changed.
+	'''
+	global _spmm_pool
+	with _spmm_pool_lock:
+		if _spmm_pool is None or _spmm_pool[0]!=PARALLEL_SPMM_MAX_THREADS:
+			if _spmm_pool is not None:
+				_spmm_pool[1].shutdown(wait=False)
+			_spmm_pool=(PARALLEL_SPMM_MAX_THREADS,
+						ThreadPoolExecutor(max_workers=PARALLEL_SPMM_MAX_THREADS))
+		return _spmm_pool[1]
+
+
+def _parallel_spmm(A, B, n_threads=None):
+	'''
+	Product between sparse matrix A and dense matrix B, with the columns of B
+	split into n_threads chunks (default: PARALLEL_SPMM_MAX_THREADS) processed
+	by the shared thread pool. The scipy.sparse kernels release the GIL, so the
+	chunks are computed concurrently and written directly into the output.
+	'''
+
+	Ncols=B.shape[1]
+	if n_threads is None:
+		n_threads=PARALLEL_SPMM_MAX_THREADS
+	n_threads=min(n_threads,Ncols)
+	bounds=np.linspace(0,Ncols,n_threads+1).astype(int)
+
+	C=np.empty((A.shape[0],Ncols),dtype=np.result_type(A.dtype,B.dtype))
+	def spmm_chunk(ii):
+		C[:,bounds[ii]:bounds[ii+1]]=A.dot(B[:,bounds[ii]:bounds[ii+1]])
+
+	list(_spmm_executor().map(spmm_chunk,range(n_threads)))
+
+	return C
+
+
 def block_dot(A, B):
 	'''
 	dot product between block matrices.
@@ -200,7 +399,7 @@ def block_sum(A, B, factA = None, factB = None):
 	return P
 
 
-def dot(A,B,type_out=None):
+def dot(A,B,type_out=None,out=None):
 	'''
 	Method to compute
 		C = A*B ,
@@ -213,92 +412,246 @@ def dot(A,B,type_out=None):
 	The following formats are supported:
 	- numpy.ndarray
 	- scipy.csc_matrix
-	'''
 
-	# determine types:
-	tA=type(A)
-	tB=type(B)
+	If a preallocated numpy.ndarray 'out' is passed, C is written into it and
+	returned (dense output only). 'out' must be C-contiguous and have the dtype
+	of the product. No memory is allocated if B is dense.
+	'''
 
-	assert tA in SupportedTypes, 'Type of A matrix (%s) not supported'%tA
-	assert tB in SupportedTypes, 'Type of B matrix (%s) not supported'%tB
+	# determine types (the checks are stripped when running with -O). Dense
+	# types are checked exactly, as np.matrix is an np.ndarray subclass
+	A_sparse=isinstance(A,csc_matrix)
+	B_sparse=isinstance(B,csc_matrix)
+	assert A_sparse or type(A) is np.ndarray, 'Type of A matrix (%s) not supported'%type(A)
+	assert B_sparse or type(B) is np.ndarray, 'Type of B matrix (%s) not supported'%type(B)
 	if type_out == None:
-		type_out=tA
+		out_sparse=A_sparse
 	else:
 		assert type_out in SupportedTypes, 'type_out not supported'
+		out_sparse=type_out==csc_matrix
+
+	if out is not None:
+		assert type_out in [None,np.ndarray], 'out only supported for dense output'
+		return _dot_out(A,B,A_sparse,B_sparse,out)
 
 	# multiply
 	# if tA==float or tb==float:
 	# 	C = A*B
 	# else:
-	if tA==np.ndarray and tB==csc_matrix:
-		C=(B.transpose()).dot(A.transpose()).transpose()
-		# C=A.dot(B.todense())
+	if getattr(A,'_libsparse_identity',False):
+		# identity (from eye_as): the product has the same type as B
+		_check_dims(A,B)
+		C=B.astype(np.result_type(A.dtype,B.dtype))
+	elif getattr(B,'_libsparse_identity',False):
+		_check_dims(A,B)
+		C=A.astype(np.result_type(A.dtype,B.dtype))
+	elif B_sparse and not A_sparse:
+		# B._T is a CSR view of B (no copy): the sparse operand is traversed by
+		# rows against unit-stride rows of A.T in a single SpMM call
+		C=B._T.dot(np.ascontiguousarray(A.T)).T
+		if not out_sparse:
+			return C
+	elif not B_sparse and B.ndim==1:
+		# matrix times vector: use the matvec kernels (gemv for dense A)
+		if not A_sparse:
+			C=np.dot(A,B)
+		elif _csc_matvec is not None:
+			# avoid scipy dispatch overhead (the kernel does not check bounds)
+			_check_dims(A,B)
+			C=np.zeros((A.shape[0],),dtype=np.result_type(A.dtype,B.dtype))
+			_csc_matvec(A.indptr,A.indices,A.data,B,C)
+		else:
+			C=A.dot(B)
+	elif A_sparse and not B_sparse:
+		# row-wise traversal of A through its cached CSR copy
+		if B.ndim==2 and PARALLEL_SPMM_MAX_THREADS>1 and \
+				B.shape[1]>=PARALLEL_SPMM_MIN_COLS and A.nnz>=PARALLEL_SPMM_MIN_NNZ:
+			C=_parallel_spmm(A._csr,B)
+		else:
+			C=A._csr.dot(B)
 	else:
 		C=A.dot(B)
 
 	# format output
-	if tA != type_out:
-		if type_out==csc_matrix:
+	if A_sparse != out_sparse:
+		if out_sparse:
 			return csc_matrix(C)
-		else:
+		elif sparse.issparse(C):
 			return C.toarray()
 
 	return C
 
 
-def solve(A,b):
+def _check_dims(A,B):
+	'''
+	Raise ValueError if the shapes of A and B do not allow the product A*B.
+	Used before the kernels that do not check their inputs (not stripped with -O,
+	as a mismatch would read/write out of bounds).
+	'''
+	if A.shape[-1]!=B.shape[0]:
+		raise ValueError('dimension mismatch: A %s, B %s'%(A.shape,B.shape))
+
+
+def _dot_out(A,B,A_sparse,B_sparse,out):
+	''' Dense product A*B written into the preallocated array out. '''
+
+	_check_dims(A,B)
+	if out.shape!=A.shape[:-1]+B.shape[1:]:
+		raise ValueError('out shape %s does not match the product shape %s'\
+									%(out.shape,A.shape[:-1]+B.shape[1:]))
+	if not out.flags.c_contiguous:
+		raise ValueError('out must be C-contiguous')
+	if out.dtype!=np.result_type(A.dtype,B.dtype):
+		raise ValueError('out must have the same dtype as the product')
+
+	if not A_sparse and not B_sparse:
+		np.dot(A,B,out=out)
+	elif A_sparse and not B_sparse:
+		# accumulate straight into out via the scipy CSR kernels
+		Acsr=A._csr
+		B=np.ascontiguousarray(B)
+		out.fill(0)
+		if B.ndim==1:
+			sparse._sparsetools.csr_matvec(Acsr.shape[0],Acsr.shape[1],
+							Acsr.indptr,Acsr.indices,Acsr.data,B,out)
+		else:
+			sparse._sparsetools.csr_matvecs(Acsr.shape[0],Acsr.shape[1],B.shape[1],
+							Acsr.indptr,Acsr.indices,Acsr.data,B.ravel(),out.ravel())
+	else:
+		out[...]=dense(dot(A,B))
+
+	return out
+
+
+def triple(CT,X,C,strip=16):
+	'''
+	Method to compute the triple product
+		P = CT*X*C ,
+	with dense/sparse/mixed matrices, as arising from the projection of X (e.g.
+	with CT=C^T). The product is computed over strips of C columns, such that
+	only an intermediate (X.shape[0],strip) block of X*C is allocated at a
+	time, instead of the full X*C matrix.
+
+	The output P is a numpy.ndarray.
+	'''
+
+	Nrows,Ncols=CT.shape[0],C.shape[1]
+	P=np.empty((Nrows,Ncols),dtype=np.result_type(CT.dtype,X.dtype,C.dtype))
+	for jj in range(0,Ncols,strip):
+		XC=dot(X,C[:,jj:jj+strip],type_out=np.ndarray)
+		P[:,jj:jj+strip]=dot(CT,XC,type_out=np.ndarray)
+
+	return P
+
+
+def solve(A,b,assume_a='gen',backend='cpu'):
 	'''
 	Wrapper of
 		numpy.linalg.solve and scipy.sparse.linalg.spsolve
 	for solution of the linear system A x = b.
 	- if A is a dense numpy array np.linalg.solve is called for solution. Note
-	that if B is sparse, this requires convertion to dense. In this case,
-	solution through LU factorisation of A should be considered to exploit the
-	sparsity of B.
+	that if B is sparse, only its non-empty columns are converted to dense and
+	solved for, the remaining columns of x being zero.
 	- if A is sparse, scipy.sparse.linalg.spsolve is used.
+
+	If the structure of A is known, assume_a can be set as per
+	scipy.linalg.solve ('sym', 'her' or 'pos') so as to use a symmetric (LDLt)
+	or Cholesky factorisation in place of LU. For sparse A, assume_a='pos' uses
+	the CHOLMOD Cholesky factorisation if scikit-sparse is installed.
+
+	For sparse A, backend='gpu' performs the triangular solutions on the GPU
+	(see lu_factorisation). As the factors are uploaded at each call, this only
+	pays off for very large systems: if the same A is used for several
+	solutions, use factorize(A, backend='gpu') instead.
 	'''
 
-	# determine types:
-	tA=type(A)
-	tB=type(b)
+	# determine types (the checks are stripped when running with -O)
+	A_sparse=isinstance(A,csc_matrix)
+	b_sparse=isinstance(b,csc_matrix)
+	assert A_sparse or type(A) is np.ndarray, 'Type of A matrix (%s) not supported'%type(A)
+	assert b_sparse or type(b) is np.ndarray, 'Type of B matrix (%s) not supported'%type(b)
 
-	assert tA in SupportedTypes, 'Type of A matrix (%s) not supported'%tA
-	assert tB in SupportedTypes, 'Type of B matrix (%s) not supported'%tB
 	# multiply
-	if tA==np.ndarray:
-		if tB==csc_matrix:
-			x=np.linalg.solve(A,b.toarray())
-		else:
+	if not A_sparse:
+		if b_sparse:
+			# only the non-empty columns of b need solving
+			nz_cols=np.flatnonzero(np.diff(b.indptr))
+			x=np.zeros(b.shape,dtype=np.result_type(A.dtype,b.dtype,np.float64))
+			if len(nz_cols)>0:
+				x[:,nz_cols]=solve(A,b[:,nz_cols].toarray(),assume_a=assume_a)
+		elif assume_a=='gen':
 			x=np.linalg.solve(A,b)
+		else:
+			x=scalg.solve(A,b,assume_a=assume_a,check_finite=False)
 	else:
-		x=spalg.spsolve(A,b)
+		if backend=='gpu':
+			x=lu_factorisation(A,backend='gpu').solve(b)
+		elif assume_a=='pos' and cholmod_cholesky is not None:
+			x=cholmod_cholesky(A)(dense(b))
+		else:
+			x=spalg.spsolve(A,b)
 
-	assert type(x) in SupportedTypes, 'Unexpected output type!'
+	assert type(x) in SupportedTypesSet, 'Unexpected output type!'
 
 	return x
 
 
+def factorize(A,backend='cpu'):
+	'''
+	Factorise the matrix A for repeated solutions of the linear system A x = b
+	- e.g. when b changes within a loop but A does not. The returned
+	lu_factorisation instance exposes a solve method:
+
+		Alu=factorize(A)
+		for b in blist:
+			x=Alu.solve(b)
+
+	Note: the output x is always dense. For sparse A, backend='gpu' keeps the
+	factors on the GPU (see lu_factorisation).
+	'''
+
+	assert type(A) in SupportedTypesSet, 'Type of A matrix (%s) not supported'%type(A)
+	return lu_factorisation(A,backend=backend)
+
+
 def dense(M):
 	''' If required, converts sparse array to dense. '''
-	if type(M) == csc_matrix:
-		return np.array(M.toarray())
-	elif type(M) == csc_matrix:
+	if sparse.issparse(M):
 		return M.toarray()
 	return M
 
 
+def auto(M,density=0.25):
+	'''
+	Returns M as numpy.ndarray if the fraction of non-zero entries exceeds
+	'density', as csc_matrix otherwise. Arrays that are not 2D are returned
+	dense.
+	'''
+	if sparse.issparse(M):
+		nnz=M.nnz
+	else:
+		M=np.asarray(M)
+		if M.ndim!=2:
+			return M
+		nnz=np.count_nonzero(M)
+	if nnz>density*M.shape[0]*M.shape[1]:
+		return dense(M)
+	if isinstance(M,csc_matrix):
+		return M
+	return csc_matrix(M)
+
+
 def eye_as(M):
 	''' Produces an identity matrix as per M, in shape and type '''
 
-	tM=type(M)
-	assert tM in SupportedTypes, 'Type %s not supported!'%tM
+	assert type(M) in SupportedTypesSet, 'Type %s not supported!'%type(M)
 	nrows=M.shape[0]
 	assert nrows==M.shape[1], 'Not a square matrix!'
 
-	if tM==csc_matrix:
-		D=csc_matrix((nrows,nrows))
-		D.setdiag(1.)
-	elif tM==np.ndarray:
+	if isinstance(M,csc_matrix):
+		D=csc_matrix(sparse.eye(nrows,format='csc'))
+		D._libsparse_identity=True
+	else:
 		D=np.eye(nrows)
 
 	return D
@@ -307,13 +660,12 @@ def eye_as(M):
 def zeros_as(M):
 	''' Produces an identity matrix as per M, in shape and type '''
 
-	tM=type(M)
-	assert tM in SupportedTypes, 'Type %s not supported!'%tM
+	assert type(M) in SupportedTypesSet, 'Type %s not supported!'%type(M)
 	nrows,ncols=M.shape
 
-	if tM==csc_matrix:
+	if isinstance(M,csc_matrix):
 		D=csc_matrix((nrows,ncols))
-	elif tM==np.ndarray:
+	else:
 		D=np.zeros_like(M)
 
 	return D
@@ -351,6 +703,35 @@ if __name__=='__main__':
 									'Unexpected type (%s) resulting from %s operations between %s and %s types'\
 									%(tout,strout,type(aa),type(bb)))
 
+		def test_index_dtype(self):
+			Asp=sparse.csc_matrix(self.A)
+			Asp.indices=Asp.indices.astype(np.int64)
+			Asp.indptr=Asp.indptr.astype(np.int64)
+			for M in [csc_matrix(Asp),csc_matrix(self.A)]:
+				assert M.indices.dtype==np.int32, 'Error in libsparse.csc_matrix'
+				assert M.indptr.dtype==np.int32, 'Error in libsparse.csc_matrix'
+				assert np.max(np.abs(M.toarray()-self.A))<1e-16, 'Error in libsparse.csc_matrix'
+
+		def test_auto(self):
+			Msp=sparse.random(20,10,density=0.05,format='csc')
+			M=Msp.toarray()
+			for mm in [M,Msp,csc_matrix(Msp)]:
+				assert type(auto(mm))==csc_matrix, 'Error in libsparse.auto'
+				assert type(auto(mm,density=0.01))==np.ndarray, 'Error in libsparse.auto'
+				assert np.max(np.abs(dense(auto(mm))-M))<1e-16, 'Error in libsparse.auto'
+			assert type(auto(self.A))==np.ndarray, 'Error in libsparse.auto'
+			assert type(auto(np.zeros((3,))))==np.ndarray, 'Error in libsparse.auto'
+
+		def test_todense(self):
+			A=self.A
+			Asp=csc_matrix(A)
+			for M in [Asp.todense(),dense(Asp),dense(Asp.T)]:
+				assert type(M) is np.ndarray, 'Error in libsparse.csc_matrix.todense'
+			assert np.max(np.abs(A-Asp.todense()))<1e-16, 'Error in libsparse.csc_matrix.todense'
+			# other types are returned as they are
+			for M in [A,None,3.]:
+				assert dense(M) is M, 'Error in libsparse.dense'
+
 		def test_zeros_as(self):
 			A=np.zeros((4,2))
 			A1=zeros_as(A)
@@ -376,6 +757,121 @@ if __name__=='__main__':
 			assert np.max(np.abs(C0-C1))<1e-12, 'Error in libsparse.dot'
 			assert np.max(np.abs(C0-C2))<1e-12, 'Error in libsparse.dot'
 			assert np.max(np.abs(C0-C3))<1e-12, 'Error in libsparse.dot'
+			assert np.max(np.abs(C0-C4.toarray()))<1e-12, 'Error in libsparse.dot'
+
+			# dense output
+			for aa in [A,csc_matrix(A)]:
+				for bb in [B,csc_matrix(B)]:
+					C=dot(aa,bb,type_out=np.ndarray)
+					assert type(C) is np.ndarray, 'Error in libsparse.dot'
+					assert np.max(np.abs(C0-C))<1e-12, 'Error in libsparse.dot'
+
+		def test_dot_out(self):
+			A,B=self.A,self.B
+			C0=np.dot(A,B)
+			for aa in [A,csc_matrix(A)]:
+				for bb in [B,csc_matrix(B)]:
+					out=np.empty((3,2))
+					C=dot(aa,bb,out=out)
+					assert C is out, 'Error in libsparse.dot'
+					assert np.max(np.abs(C0-out))<1e-12, 'Error in libsparse.dot'
+
+			v=np.random.rand(4)+1.j
+			out=np.empty((3,),dtype=complex)
+			dot(csc_matrix(A),v,out=out)
+			assert np.max(np.abs(np.dot(A,v)-out))<1e-12, 'Error in libsparse.dot'
+
+			# shape mismatch
+			for aa in [A,csc_matrix(A)]:
+				for bb,out in [(B,np.empty((2,2))),(np.ones((5,2)),np.empty((3,2))),
+							   (np.ones(5),np.empty((3,))),(np.ones(4),np.empty((4,))),
+							   (B,np.empty((2,3)).T),(B,np.empty((3,2),dtype=complex))]:
+					with self.assertRaises(ValueError):
+						dot(aa,bb,out=out)
+
+		def test_dot_matrix_type(self):
+			# np.matrix is an np.ndarray subclass, but is not supported
+			M=np.matrix(self.A)
+			for aa,bb in [(M,np.ones(4)),(self.A,np.matrix(self.B)),(csc_matrix(self.A),M.T)]:
+				with self.assertRaises(AssertionError):
+					dot(aa,bb)
+			with self.assertRaises(AssertionError):
+				solve(np.matrix(np.eye(3)),np.ones(3))
+
+		def test_dot_vector(self):
+			A=self.A
+			Asp=csc_matrix(A)
+			for v in [np.random.rand(4),np.random.rand(4)+1.j*np.random.rand(4)]:
+				C0=np.dot(A,v)
+				for C1 in [dot(Asp,v),dot(A,v),dot(Asp,v,type_out=np.ndarray)]:
+					assert type(C1)==np.ndarray, 'Error in libsparse.dot'
+					assert C1.shape==C0.shape, 'Error in libsparse.dot'
+					assert np.max(np.abs(C0-C1))<1e-12, 'Error in libsparse.dot'
+
+			for v in [np.arange(3.),np.arange(5.)]:
+				for aa in [A,Asp]:
+					with self.assertRaises(ValueError):
+						dot(aa,v)
+
+		def test_triple(self):
+			X=np.random.rand(4,4)
+			C=np.random.rand(4,20)
+			P0=np.dot(C.T,np.dot(X,C))
+			for xx in [X,csc_matrix(X)]:
+				for ccT,cc in [(C.T,C),(csc_matrix(C.T),csc_matrix(C))]:
+					P=triple(ccT,xx,cc,strip=3)
+					assert np.max(np.abs(P0-P))<1e-12, 'Error in libsparse.triple'
+
+		def test_parallel_spmm(self):
+			Asp=csc_matrix(sparse.random(60,50,density=0.1,format='csc'))
+			B=np.random.rand(50,40)
+			C0=Asp.dot(B)
+			for n_threads in [1,3,8]:
+				C=_parallel_spmm(Asp,B,n_threads)
+				assert np.max(np.abs(C0-C))<1e-12, 'Error in libsparse._parallel_spmm'
+			assert _spmm_executor() is _spmm_executor(), 'Thread pool not reused'
+
+		def test_dot_identity(self):
+			A,B=self.A,self.B
+			Asp,Bsp=csc_matrix(A),csc_matrix(B)
+			Ia=eye_as(csc_matrix(np.zeros((3,3))))
+			Ib=eye_as(Bsp[:2,:2])
+			assert type(dot(Ia,A)) is np.ndarray, 'Error in libsparse.dot'
+			assert type(dot(Ia,Asp)) is csc_matrix, 'Error in libsparse.dot'
+			assert np.max(np.abs(dense(dot(Ia,Asp))-A))<1e-16, 'Error in libsparse.dot'
+			assert np.max(np.abs(dot(B,Ib)-B))<1e-16, 'Error in libsparse.dot'
+			assert np.max(np.abs(dense(dot(Bsp,Ib))-B))<1e-16, 'Error in libsparse.dot'
+
+			# shapes are still checked
+			for aa,bb in [(Ia,np.random.rand(5,2)),(np.random.rand(2,3),Ib)]:
+				with self.assertRaises(ValueError):
+					dot(aa,bb)
+
+			# flag removed upon modification
+			Ib.setdiag(2.)
+			assert np.max(np.abs(dot(B[:,:2],Ib)-2.*B[:,:2]))<1e-16, 'Error in libsparse.dot'
+			Ia[0,0]=2.
+			assert np.max(np.abs(dot(Ia,A)[0]-2.*A[0]))<1e-16, 'Error in libsparse.dot'
+
+		def test_csr_cache(self):
+			A,B=self.A,self.B
+			Asp=csc_matrix(A)
+			assert np.max(np.abs(dot(Asp,B)-np.dot(A,B)))<1e-12, 'Error in libsparse.dot'
+			Asp[0,0]=0.
+			A[0,0]=0.
+			assert np.max(np.abs(dot(Asp,B)-np.dot(A,B)))<1e-12, 'Error in libsparse.dot'
+			Asp*=2.
+			assert np.max(np.abs(dot(Asp,B)-2.*np.dot(A,B)))<1e-12, 'Error in libsparse.dot'
+			# transpose cache
+			C=np.random.rand(3,3)
+			assert np.max(np.abs(dot(C,Asp)-2.*np.dot(C,A)))<1e-12, 'Error in libsparse.dot'
+			Asp[1,2]=0.
+			A[1,2]=0.
+			assert np.max(np.abs(dot(C,Asp)-2.*np.dot(C,A)))<1e-12, 'Error in libsparse.dot'
+			Asp.setdiag(0.)
+			np.fill_diagonal(A,0.)
+			assert np.max(np.abs(dot(Asp,B)-2.*np.dot(A,B)))<1e-12, 'Error in libsparse.dot'
+			assert np.max(np.abs(dot(C,Asp)-2.*np.dot(C,A)))<1e-12, 'Error in libsparse.dot'
 
 		def test_solve(self):
 			A=np.random.rand(4,4)
@@ -394,6 +890,34 @@ if __name__=='__main__':
 			assert np.max(np.abs(X0-X3))<1e-12, 'Error in libsparse.solve'
 			assert np.max(np.abs(X0-X4))<1e-12, 'Error in libsparse.solve'
 
+			# sparse b with empty columns
+			B[:,1]=0.
+			X0=np.linalg.solve(A,B)
+			X5=solve(A,csc_matrix(B))
+			assert np.max(np.abs(X0-X5))<1e-12, 'Error in libsparse.solve'
+
+		def test_solve_spd(self):
+			A=np.random.rand(4,4)
+			A=np.dot(A.T,A)+np.eye(4)
+			B=np.random.rand(4,2)
+			X0=np.linalg.solve(A,B)
+
+			for assume_a in ['sym','pos']:
+				for aa in [A,csc_matrix(A)]:
+					X=solve(aa,B,assume_a=assume_a)
+					assert np.max(np.abs(X0-X))<1e-12, 'Error in libsparse.solve'
+
+		def test_factorize(self):
+			A=np.random.rand(4,4)+4.*np.eye(4)
+			B=np.random.rand(4,2)
+			X0=np.linalg.solve(A,B)
+
+			for aa in [A,csc_matrix(A)]:
+				Alu=factorize(aa)
+				for bb in [B,csc_matrix(B)]:
+					X=Alu.solve(bb)
+					assert np.max(np.abs(X0-X))<1e-12, 'Error in libsparse.factorize'
+
 
 	outprint='Testing libsparse'
 	print('\n' + 70*'-')
@@ -14,16 +14,21 @@ Classes:
 	- freqresp: wraps the freqresp function
 	- addGain: adds gains in input/output. This is not a wrapper of addGain, as
 	the system matrices are overwritten
+- ss_packed: dense state-space model stored in a single contiguous buffer.
+- ss_batch: batch of dense state-space models of same size, stacked along the
+	first axis.
 
 Methods for state-space manipulation:
 - couple: feedback coupling. Does not support sparsity
 - freqresp: calculate frequency response. Supports sparsity.
+- freqresp_batch: calculate frequency response of a batch of systems.
 - series: series connection between systems
 - parallel: parallel connection between systems
 - SSconv: convert state-space model with predictions and delays
 - addGain: add gains to state-space model.
 - join2: merge two state-space models into one.
 - join: merge a list of state-space models into one.
+- block_diag_ss: block-diagonal join of a list of state-space models/gains.
 - sum state-space models and/or gains
 - scale_SS: scale state-space model
 - simulate: simulates discrete time solution
@@ -45,7 +50,6 @@ Comments:
 - the module supports sparse matrices hence relies on libsparse.
 
 to do:
-	- remove unnecessary coupling routines
 	- couple function can handle sparse matrices but only outputs dense matrices
 		- verify if typical coupled systems are sparse
 		- update routine
@@ -59,9 +63,18 @@ import scipy.signal as scsig
 import scipy.linalg as scalg
 import scipy.interpolate as scint
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # dependency
 import sharpy.linear.src.libsparse as libsp
 
+# in freqresp, frequencies are processed in chunks such that the workspace of
+# the vectorised back-substitution holds at most this many complex entries
+FREQRESP_MAX_WORKSPACE = 2 ** 22
+
 
 # ------------------------------------------------------------- Dedicated class
 
@@ -149,14 +162,9 @@ class ss():
         self._states = value
 
     def check_types(self):
-        assert type(self.A) in libsp.SupportedTypes, \
-            'Type of A matrix (%s) not supported' % type(self.A)
-        assert type(self.B) in libsp.SupportedTypes, \
-            'Type of B matrix (%s) not supported' % type(self.B)
-        assert type(self.C) in libsp.SupportedTypes, \
-            'Type of C matrix (%s) not supported' % type(self.C)
-        assert type(self.D) in libsp.SupportedTypes, \
-            'Type of D matrix (%s) not supported' % type(self.D)
+        for name, M in zip('ABCD', self.get_mats()):
+            if type(M) not in libsp.SupportedTypesSet:
+                raise TypeError('Type of %s matrix (%s) not supported' % (name, type(M)))
 
     def get_mats(self):
         return self.A, self.B, self.C, self.D
@@ -499,6 +507,89 @@ class ss_block():
         return xn1, yn
 
 
+class ss_packed():
+    """
+    Dense state-space model whose matrices are stored in a single contiguous
+    buffer
+
+        M = [[A, B],
+             [C, D]]
+
+    of shape (Nx+Ny, Nx+Nu). A, B, C, D are views of M, hence improve locality
+    for small systems and allow simulate to advance states and outputs
+    through a single matrix-vector product, [x_{n+1}; y_n] = M [x_n; u_n].
+    """
+
+    def __init__(self, A, B, C, D, dt=None):
+
+        Nx, Ny = A.shape[0], C.shape[0]
+        Nu = D.shape[1] if D.ndim == 2 else 1
+        dtype = np.result_type(A.dtype, B.dtype, C.dtype, D.dtype)
+
+        self.M = np.empty((Nx + Ny, Nx + Nu), dtype=dtype)
+        self.A = self.M[:Nx, :Nx]
+        self.B = self.M[:Nx, Nx:]
+        self.C = self.M[Nx:, :Nx]
+        self.D = self.M[Nx:, Nx:]
+        self.A[:] = libsp.dense(A)
+        self.B[:] = libsp.dense(B).reshape((Nx, Nu))
+        self.C[:] = libsp.dense(C)
+        self.D[:] = libsp.dense(D).reshape((Ny, Nu))
+        self.dt = dt
+
+        self.states, self.inputs, self.outputs = Nx, Nu, Ny
+
+    @classmethod
+    def from_ss(cls, SS):
+        """ Build packed model from a libss.ss instance. """
+        return cls(SS.A, SS.B, SS.C, SS.D, dt=SS.dt)
+
+    def get_mats(self):
+        return self.A, self.B, self.C, self.D
+
+    def freqresp(self, wv):
+        return freqresp(self, wv, dlti=self.dt is not None)
+
+
+class ss_batch():
+    """
+    Batch of Nsys dense state-space models with the same number of states,
+    inputs and outputs (e.g. a model evaluated at different parameters). The
+    matrices are stacked along the first axis, i.e.
+
+        A: (Nsys, Nx, Nx), B: (Nsys, Nx, Nu), C: (Nsys, Ny, Nx), D: (Nsys, Ny, Nu)
+
+    in contiguous arrays. In freqresp_batch, the frequency response of each
+    system is vectorised over all the frequencies.
+    """
+
+    def __init__(self, A, B, C, D, dt=None):
+
+        self.A, self.B, self.C, self.D = [np.asarray(M) for M in (A, B, C, D)]
+        for M in self.get_mats():
+            assert M.ndim == 3, 'Matrices of a batch of systems need to be 3D arrays'
+        self.dt = dt
+
+        Nsys, Nx, Nu = self.B.shape
+        self.systems, self.states, self.inputs, self.outputs = \
+            Nsys, Nx, Nu, self.C.shape[1]
+
+    @classmethod
+    def from_ss_list(cls, SS_list):
+        """ Stack a list of state-space models with same size and time-step. """
+        dt = SS_list[0].dt
+        assert all([SS.dt == dt for SS in SS_list]), \
+            'DLTI systems do not have the same time-step!'
+        return cls(*[np.stack([libsp.dense(SS.get_mats()[ii]) for SS in SS_list])
+                     for ii in range(4)], dt=dt)
+
+    def get_mats(self):
+        return self.A, self.B, self.C, self.D
+
+    def freqresp(self, wv):
+        return freqresp_batch(self, wv)
+
+
 # ---------------------------------------- Methods for state-space manipulation
 def project(ss_here,WT,V):
     '''
@@ -536,8 +627,13 @@ def couple(ss01, ss02, K12, K21, out_sparse=False):
     assert K21.shape == (ss02.inputs, ss01.outputs), \
         'Gain K21 shape not matching with systems number of inputs/outputs'
 
-    A1, B1, C1, D1 = ss01.get_mats()
-    A2, B2, C2, D2 = ss02.get_mats()
+    if out_sparse:
+        raise NameError('out_sparse=True not supported yet (verify if worth it first).')
+
+    # the coupled system is dense: densify all the inputs once
+    A1, B1, C1, D1 = [libsp.dense(M) for M in ss01.get_mats()]
+    A2, B2, C2, D2 = [libsp.dense(M) for M in ss02.get_mats()]
+    K12, K21 = libsp.dense(K12), libsp.dense(K21)
 
     # extract size
     Nx1, Nu1 = B1.shape
@@ -548,51 +644,80 @@ def couple(ss01, ss02, K12, K21, out_sparse=False):
     #  terms to invert
     maxD1 = np.max(np.abs(D1))
     maxD2 = np.max(np.abs(D2))
-    if maxD1 < 1e-32:
-        pass
-    if maxD2 < 1e-32:
-        pass
 
-    # compute self-influence gains
-    K11 = libsp.dot(K12, libsp.dot(D2, K21))
-    K22 = libsp.dot(K21, libsp.dot(D1, K12))
-
-    # left hand side terms
-    L1 = libsp.dot(-K11, D1)
-    L2 = libsp.dot(-K22, D2)
-    L1 += libsp.eye_as(L1)
-    L2 += libsp.eye_as(L2)
+    D2K21 = np.dot(D2, K21)
+    D1K12 = np.dot(D1, K12)
 
     # coupling terms
-    cpl_12 = libsp.solve(L1, K12)
-    cpl_21 = libsp.solve(L2, K21)
+    if maxD1 < 1e-32 or maxD2 < 1e-32:
+        # one system is strictly proper: K11*D1 = K22*D2 = 0, hence L1 = L2 = I.
+        # The threshold only catches (numerically) exact zeros, so that results
+        # are the same as with the general path up to round-off.
+        cpl_12 = K12
+        cpl_21 = K21
+    else:
+        # compute self-influence gains
+        K11 = np.dot(K12, D2K21)
+        K22 = np.dot(K21, D1K12)
+
+        # left hand side terms
+        L1 = np.dot(-K11, D1)
+        L2 = np.dot(-K22, D2)
+        L1 += np.eye(Nu1)
+        L2 += np.eye(Nu2)
 
-    cpl_11 = libsp.dot(cpl_12, libsp.dot(D2, K21))
-    cpl_22 = libsp.dot(cpl_21, libsp.dot(D1, K12))
+        cpl_12 = np.linalg.solve(L1, K12)
+        cpl_21 = np.linalg.solve(L2, K21)
+
+    cpl_11 = np.dot(cpl_12, D2K21)
+    cpl_22 = np.dot(cpl_21, D1K12)
 
     # Build coupled system
-    if out_sparse:
-        raise NameError('out_sparse=True not supported yet (verify if worth it first).')
-    else:
-        A = np.block([
-            [libsp.dense(A1 + libsp.dot(libsp.dot(B1, cpl_11), C1)), libsp.dense(libsp.dot(libsp.dot(B1, cpl_12), C2))],
-            [libsp.dense(libsp.dot(libsp.dot(B2, cpl_21), C1)),
-             libsp.dense(A2 + libsp.dot(libsp.dot(B2, cpl_22), C2))]])
-
-        C = np.block([
-            [libsp.dense(C1 + libsp.dot(libsp.dot(D1, cpl_11), C1)), libsp.dense(libsp.dot(libsp.dot(D1, cpl_12), C2))],
-            [libsp.dense(libsp.dot(libsp.dot(D2, cpl_21), C1)),
-             libsp.dense(C2 + libsp.dot(libsp.dot(D2, cpl_22), C2))]])
-
-        B = np.block([
-            [libsp.dense(B1 + libsp.dot(libsp.dot(B1, cpl_11), D1)), libsp.dense(libsp.dot(libsp.dot(B1, cpl_12), D2))],
-            [libsp.dense(libsp.dot(libsp.dot(B2, cpl_21), D1)),
-             libsp.dense(B2 + libsp.dot(libsp.dot(B2, cpl_22), D2))]])
-
-        D = np.block([
-            [libsp.dense(D1 + libsp.dot(libsp.dot(D1, cpl_11), D1)), libsp.dense(libsp.dot(libsp.dot(D1, cpl_12), D2))],
-            [libsp.dense(libsp.dot(libsp.dot(D2, cpl_21), D1)),
-             libsp.dense(D2 + libsp.dot(libsp.dot(D2, cpl_22), D2))]])
+    dtype = np.result_type(A1, B1, C1, D1, A2, B2, C2, D2,
+                           cpl_11, cpl_12, cpl_21, cpl_22)
+    Nx, Nu, Ny = Nx1 + Nx2, Nu1 + Nu2, Ny1 + Ny2
+
+    # products shared by the state (A, C) and input (B, D) blocks
+    B1c11 = np.dot(B1, cpl_11)
+    B1c12 = np.dot(B1, cpl_12)
+    B2c21 = np.dot(B2, cpl_21)
+    B2c22 = np.dot(B2, cpl_22)
+    D1c11 = np.dot(D1, cpl_11)
+    D1c12 = np.dot(D1, cpl_12)
+    D2c21 = np.dot(D2, cpl_21)
+    D2c22 = np.dot(D2, cpl_22)
+
+    A = np.empty((Nx, Nx), dtype=dtype)
+    A[:Nx1, :Nx1] = A1
+    A[:Nx1, :Nx1] += np.dot(B1c11, C1)
+    A[:Nx1, Nx1:] = np.dot(B1c12, C2)
+    A[Nx1:, :Nx1] = np.dot(B2c21, C1)
+    A[Nx1:, Nx1:] = A2
+    A[Nx1:, Nx1:] += np.dot(B2c22, C2)
+
+    C = np.empty((Ny, Nx), dtype=dtype)
+    C[:Ny1, :Nx1] = C1
+    C[:Ny1, :Nx1] += np.dot(D1c11, C1)
+    C[:Ny1, Nx1:] = np.dot(D1c12, C2)
+    C[Ny1:, :Nx1] = np.dot(D2c21, C1)
+    C[Ny1:, Nx1:] = C2
+    C[Ny1:, Nx1:] += np.dot(D2c22, C2)
+
+    B = np.empty((Nx, Nu), dtype=dtype)
+    B[:Nx1, :Nu1] = B1
+    B[:Nx1, :Nu1] += np.dot(B1c11, D1)
+    B[:Nx1, Nu1:] = np.dot(B1c12, D2)
+    B[Nx1:, :Nu1] = np.dot(B2c21, D1)
+    B[Nx1:, Nu1:] = B2
+    B[Nx1:, Nu1:] += np.dot(B2c22, D2)
+
+    D = np.empty((Ny, Nu), dtype=dtype)
+    D[:Ny1, :Nu1] = D1
+    D[:Ny1, :Nu1] += np.dot(D1c11, D1)
+    D[:Ny1, Nu1:] = np.dot(D1c12, D2)
+    D[Ny1:, :Nu1] = np.dot(D2c21, D1)
+    D[Ny1:, Nu1:] = D2
+    D[Ny1:, Nu1:] += np.dot(D2c22, D2)
 
     return ss(A, B, C, D, dt=ss01.dt)
 
@@ -661,152 +786,6 @@ def remove_inout_channels(sys, retain_channels, where):
     return sys
 
 
-
-
-# def couple_wrong02(ss01, ss02, K12, K21):
-#     """
-#     Couples 2 dlti systems ss01 and ss02 through the gains K12 and K21, where
-#     K12 transforms the output of ss02 into an input of ss01.
-#     """
-
-#     assert ss01.dt == ss02.dt, 'Time-steps not matching!'
-#     assert K12.shape == (ss01.inputs, ss02.outputs), \
-#         'Gain K12 shape not matching with systems number of inputs/outputs'
-#     assert K21.shape == (ss02.inputs, ss01.outputs), \
-#         'Gain K21 shape not matching with systems number of inputs/outputs'
-
-#     A1, B1, C1, D1 = ss01.A, ss01.B, ss01.C, ss01.D
-#     A2, B2, C2, D2 = ss02.A, ss02.B, ss02.C, ss02.D
-
-#     # extract size
-#     Nx1, Nu1 = B1.shape
-#     Ny1 = C1.shape[0]
-#     Nx2, Nu2 = B2.shape
-#     Ny2 = C2.shape[0]
-
-#     #  terms to invert
-#     maxD1 = np.max(np.abs(D1))
-#     maxD2 = np.max(np.abs(D2))
-#     if maxD1 < 1e-32:
-#         pass
-#     if maxD2 < 1e-32:
-#         pass
-
-#     # terms solving for u21 (input of ss02 due to ss01)
-#     K11 = np.dot(K12, np.dot(D2, K21))
-#     # L1=np.eye(Nu1)-np.dot(K11,D1)
-#     L1inv = np.linalg.inv(np.eye(Nu1) - np.dot(K11, D1))
-
-#     # coupling terms for u21
-#     cpl_11 = np.dot(L1inv, K11)
-#     cpl_12 = np.dot(L1inv, K12)
-
-#     # terms solving for u12 (input of ss01 due to ss02)
-#     T = np.dot(np.dot(K21, D1), L1inv)
-
-#     # coupling terms for u21
-#     cpl_21 = K21 + np.dot(T, K11)
-#     cpl_22 = np.dot(T, K12)
-
-#     # Build coupled system
-#     A = np.block([
-#         [A1 + np.dot(np.dot(B1, cpl_11), C1), np.dot(np.dot(B1, cpl_12), C2)],
-#         [np.dot(np.dot(B2, cpl_21), C1), A2 + np.dot(np.dot(B2, cpl_22), C2)]])
-
-#     C = np.block([
-#         [C1 + np.dot(np.dot(D1, cpl_11), C1), np.dot(np.dot(D1, cpl_12), C2)],
-#         [np.dot(np.dot(D2, cpl_21), C1), C2 + np.dot(np.dot(D2, cpl_22), C2)]])
-
-#     B = np.block([
-#         [B1 + np.dot(np.dot(B1, cpl_11), D1), np.dot(np.dot(B1, cpl_12), D2)],
-#         [np.dot(np.dot(B2, cpl_21), D1), B2 + np.dot(np.dot(B2, cpl_22), D2)]])
-
-#     D = np.block([
-#         [D1 + np.dot(np.dot(D1, cpl_11), D1), np.dot(np.dot(D1, cpl_12), D2)],
-#         [np.dot(np.dot(D2, cpl_21), D1), D2 + np.dot(np.dot(D2, cpl_22), D2)]])
-
-#     if ss01.dt is None:
-#         sstot = scsig.lti(A, B, C, D)
-#     else:
-#         sstot = scsig.dlti(A, B, C, D, dt=ss01.dt)
-#     return sstot
-
-
-# def couple_wrong(ss01, ss02, K12, K21):
-#     """
-#     Couples 2 dlti systems ss01 and ss02 through the gains K12 and K21, where
-#     K12 transforms the output of ss02 into an input of ss01.
-#     """
-
-#     assert ss01.dt == ss02.dt, 'Time-steps not matching!'
-#     assert K12.shape == (ss01.inputs, ss02.outputs), \
-#         'Gain K12 shape not matching with systems number of inputs/outputs'
-#     assert K21.shape == (ss02.inputs, ss01.outputs), \
-#         'Gain K21 shape not matching with systems number of inputs/outputs'
-
-#     A1, B1, C1, D1 = ss01.A, ss01.B, ss01.C, ss01.D
-#     A2, B2, C2, D2 = ss02.A, ss02.B, ss02.C, ss02.D
-
-#     # extract size
-#     Nx1, Nu1 = B1.shape
-#     Ny1 = C1.shape[0]
-#     Nx2, Nu2 = B2.shape
-#     Ny2 = C2.shape[0]
-
-#     #  terms to invert
-#     maxD1 = np.max(np.abs(D1))
-#     maxD2 = np.max(np.abs(D2))
-#     if maxD1 < 1e-32:
-#         pass
-#     if maxD2 < 1e-32:
-#         pass
-
-#     # compute self-coupling terms
-#     S1 = np.dot(K12, np.dot(D2, K21))
-#     S2 = np.dot(K21, np.dot(D1, K12))
-
-#     # left hand side terms
-#     L1 = np.eye(Nu1) - np.dot(S1, D1)
-#     L2 = np.eye(Nu2) - np.dot(S2, D2)
-
-#     # invert left hand side terms
-#     L1inv = np.linalg.inv(L1)
-#     L2inv = np.linalg.inv(L2)
-
-#     # recurrent terms
-#     L1invS1 = np.dot(L1inv, S1)
-#     L2invS2 = np.dot(L2inv, S2)
-
-#     L1invK12 = np.dot(L1inv, K12)
-#     L2invK21 = np.dot(L2inv, K21)
-
-#     # Build coupled system
-#     A = np.block([
-#         [A1 + np.dot(np.dot(B1, L1invS1), C1), np.dot(np.dot(B1, L1invK12), C2)],
-#         [np.dot(np.dot(B2, L2invK21), C1), A2 + np.dot(np.dot(B2, L2invS2), C2)]])
-
-#     C = np.block([
-#         [C1 + np.dot(np.dot(D1, L1invS1), C1), np.dot(np.dot(D1, L1invK12), C2)],
-#         [np.dot(np.dot(D2, L2invK21), C1), C2 + np.dot(np.dot(D2, L2invS2), C2)]])
-
-#     B = np.block([
-#         [B1 + np.dot(np.dot(B1, L1invS1), D1), np.dot(np.dot(B1, L1invK12), D2)],
-#         [np.dot(np.dot(B2, L2invK21), D1), B2 + np.dot(np.dot(B2, L2invS2), D2)]])
-
-#     D = np.block([
-#         [D1 + np.dot(np.dot(D1, L1invS1), D1), np.dot(np.dot(D1, L1invK12), D2)],
-#         [np.dot(np.dot(D2, L2invK21), D1), D2 + np.dot(np.dot(D2, L2invS2), D2)]])
-
-#     if ss01.dt is None:
-#         sstot = scsig.lti(A, B, C, D)
-#     else:
-#         sstot = scsig.dlti(A, B, C, D, dt=ss01.dt)
-#     return sstot
-
-
-
-
-
 def freqresp(SS, wv, dlti=True):
     """
     In-house frequency response function supporting dense/sparse types
@@ -819,15 +798,18 @@ def freqresp(SS, wv, dlti=True):
     Outputs:
     - Yfreq[outputs,inputs,len(wv)]: frequency response over wv
 
-    Warnings:
-    -  This function may not be very efficient for dense matrices (as A is not
-    reduced to upper Hessenberg form), but can exploit sparsity in the state-space
-    matrices.
+    Comments:
+    - if A is dense, this is reduced once to complex Schur (upper triangular)
+    form, so that each frequency only requires a triangular solve. The
+    reduction is skipped if A is already upper triangular (e.g. modal form).
+    - if A is sparse, a sparse solve is performed at each frequency, exploiting
+    the sparsity of the state-space matrices.
     """
 
-    assert type(SS) == ss, \
+    assert type(SS) in (ss, ss_packed), \
         'Type %s of state-space model not supported. Use libss.ss instead!' % type(SS)
-    SS.check_types()
+    if type(SS) == ss:
+        SS.check_types()
 
     if hasattr(SS, 'dt') and dlti:
         Ts = SS.dt
@@ -847,10 +829,127 @@ def freqresp(SS, wv, dlti=True):
     Nw = len(wv)
 
     Yfreq = np.empty((Ny, Nu, Nw,), dtype=np.complex_)
-    Eye = libsp.eye_as(SS.A)
-    for ii in range(Nw):
-        sol_cplx = libsp.solve(zv[ii] * Eye - SS.A, SS.B)
-        Yfreq[:, :, ii] = libsp.dot(SS.C, sol_cplx, type_out=np.ndarray) + SS.D
+    D_dense = libsp.dense(SS.D).reshape((Ny, Nu))
+    if isinstance(SS.A, np.ndarray):
+        T, Bt, Ct = _schur_form(SS.A, libsp.dense(SS.B).reshape((Nx, Nu)), SS.C)
+        # zv[ii] I - T: only the diagonal is updated at each frequency
+        Tshift = -T
+        Tdiag = Tshift.diagonal().copy()
+        if Nw > Nx:
+            _freqresp_backsub(T, Bt, Ct, D_dense, zv, Yfreq)
+        elif Nu == 1 and Ny == 1:
+            # SISO: single rhs vector and scalar output
+            bt, ct, d = Bt[:, 0], Ct.reshape((Nx,)), D_dense[0, 0]
+            for ii in range(Nw):
+                Tshift.flat[::Nx + 1] = zv[ii] + Tdiag
+                Yfreq[0, 0, ii] = np.dot(
+                    ct, scalg.solve_triangular(Tshift, bt, check_finite=False)) + d
+        else:
+            for ii in range(Nw):
+                Tshift.flat[::Nx + 1] = zv[ii] + Tdiag
+                sol_cplx = scalg.solve_triangular(Tshift, Bt, check_finite=False)
+                np.matmul(Ct, sol_cplx, out=Yfreq[:, :, ii])
+                Yfreq[:, :, ii] += D_dense
+    else:
+        # zv[ii] I - A: allocate -A with an explicit entry in each diagonal slot,
+        # such that only these entries are overwritten at each frequency
+        Acoo = SS.A.tocoo()
+        diag = np.arange(Nx)
+        Ashift = libsp.csc_matrix(
+            (np.concatenate((-Acoo.data, np.zeros((Nx,)))).astype(np.complex_),
+             (np.concatenate((Acoo.row, diag)), np.concatenate((Acoo.col, diag)))),
+            shape=(Nx, Nx))
+        Ashift.sort_indices()
+        diag_pos = np.flatnonzero(
+            Ashift.indices == np.repeat(diag, np.diff(Ashift.indptr)))
+        Adiag = Ashift.data[diag_pos]
+        for ii in range(Nw):
+            Ashift.data[diag_pos] = zv[ii] + Adiag
+            sol_cplx = libsp.solve(Ashift, SS.B)
+            # spsolve returns a 1D array if B has a single column
+            Yfreq[:, :, ii] = libsp.dot(
+                SS.C, sol_cplx, type_out=np.ndarray).reshape((Ny, Nu))
+            Yfreq[:, :, ii] += D_dense
+
+    return Yfreq
+
+
+def _schur_form(A, B, C):
+    """
+    Returns the matrices (T, U^H B, C U) of the system with dense A = U T U^H
+    reduced to complex Schur (upper triangular) form. The reduction is skipped
+    if A is already upper triangular (e.g. modal form). The finiteness of A is
+    checked here, and does not need to be at each triangular solve.
+    """
+
+    if np.any(np.tril(A, -1)):
+        T, U = scalg.schur(A, output='complex')
+        return T, np.dot(U.conj().T, B), libsp.dot(C, U, type_out=np.ndarray)
+    return A.astype(np.complex_), B, libsp.dense(C)
+
+
+def _freqresp_backsub(T, Bt, Ct, D, zv, Yfreq, max_workspace=None):
+    """
+    Frequency response at the points zv of the system (T, Bt, Ct, D), with T
+    upper triangular, written into Yfreq[outputs,inputs,len(zv)]. The
+    back-substitution over the rows of T,
+
+        X[kk] = (Bt[kk] + T[kk,kk+1:] X[kk+1:])/(zv - T[kk,kk]),
+
+    is vectorised over the frequencies, which are processed in chunks so as to
+    allocate at most max_workspace (default: FREQRESP_MAX_WORKSPACE) complex
+    entries for X.
+    """
+
+    if max_workspace is None:
+        max_workspace = FREQRESP_MAX_WORKSPACE
+    Nx, Nu = Bt.shape
+    Nw = len(zv)
+    Nchunk = max(1, min(Nw, max_workspace // (Nx * Nu)))
+    X = np.empty((Nx, Nu, Nchunk), dtype=np.complex_)
+    Tdiag = T.diagonal()
+
+    for jj in range(0, Nw, Nchunk):
+        zc = zv[jj:jj + Nchunk]
+        Xc = X[:, :, :len(zc)]
+        for kk in range(Nx - 1, -1, -1):
+            Xc[kk] = Bt[kk, :, np.newaxis]
+            Xc[kk] += np.tensordot(T[kk, kk + 1:], Xc[kk + 1:], axes=1)
+            Xc[kk] /= zc - Tdiag[kk]
+        Yfreq[:, :, jj:jj + len(zc)] = np.tensordot(Ct, Xc, axes=1)
+    Yfreq += D[:, :, np.newaxis]
+
+    return Yfreq
+
+
+def freqresp_batch(SSb, wv, dlti=True):
+    """
+    Frequency response of a batch of state-space models (see ss_batch).
+
+    Inputs:
+    - SSb: instance of ss_batch class
+    - wv: frequency range
+    - dlti: True if discrete-time systems are considered.
+
+    Outputs:
+    - Yfreq[systems,outputs,inputs,len(wv)]: frequency response over wv
+
+    Comments:
+    - the A matrix of each system is reduced once to complex Schur form, and the
+    triangular systems are then solved for all frequencies at once (see
+    freqresp). Only the Nsys*Ny*Nu*len(wv) outputs are allocated in full.
+    """
+
+    if SSb.dt is not None and dlti:
+        wTs = SSb.dt * wv
+        zv = np.cos(wTs) + 1.j * np.sin(wTs)
+    else:
+        zv = 1.j * wv
+
+    Yfreq = np.empty((SSb.systems, SSb.outputs, SSb.inputs, len(wv)),
+                     dtype=np.complex_)
+    for A, B, C, D, Yhere in zip(SSb.A, SSb.B, SSb.C, SSb.D, Yfreq):
+        _freqresp_backsub(*_schur_form(A, B, C), D, zv, Yhere)
 
     return Yfreq
 
@@ -885,17 +984,22 @@ def series(SS01, SS02):
     Nst = Nst01 + Nst02
     Nin = SS01.inputs
     Nout = SS02.outputs
+    dtype = np.result_type(*[M.dtype for M in SS01.get_mats() + SS02.get_mats()])
 
     # Build A matrix
-    A = np.zeros((Nst, Nst))
+    A = np.zeros((Nst, Nst), dtype=dtype)
 
     A[:Nst01, :Nst01] = libsp.dense(SS01.A)
     A[Nst01:, Nst01:] = libsp.dense(SS02.A)
     A[Nst01:, :Nst01] = libsp.dense(libsp.dot(SS02.B, SS01.C))
 
     # Build the rest
-    B = np.concatenate((libsp.dense(SS01.B), libsp.dense(libsp.dot(SS02.B, SS01.D))), axis=0)
-    C = np.concatenate((libsp.dense(libsp.dot(SS02.D, SS01.C)), libsp.dense(SS02.C)), axis=1)
+    B = np.empty((Nst, Nin), dtype=dtype)
+    B[:Nst01, :] = libsp.dense(SS01.B)
+    B[Nst01:, :] = libsp.dense(libsp.dot(SS02.B, SS01.D))
+    C = np.empty((Nout, Nst), dtype=dtype)
+    C[:, :Nst01] = libsp.dense(libsp.dot(SS02.D, SS01.C))
+    C[:, Nst01:] = libsp.dense(SS02.C)
     D = libsp.dense(libsp.dot(SS02.D, SS01.D))
 
     SStot = ss(A, B, C, D, dt=SS01.dt)
@@ -929,24 +1033,53 @@ def parallel(SS01, SS02):
     Nst = Nst01 + Nst02
     Nin01, Nin02 = SS01.inputs, SS02.inputs
     Nin = Nin01 + Nin02
+    dtype = np.result_type(SS01.A, SS01.B, SS01.C, SS01.D,
+                           SS02.A, SS02.B, SS02.C, SS02.D)
 
     # Build A,B matrix
-    A = np.zeros((Nst, Nst))
+    A = np.zeros((Nst, Nst), dtype=dtype)
     A[:Nst01, :Nst01] = SS01.A
     A[Nst01:, Nst01:] = SS02.A
-    B = np.zeros((Nst, Nin))
+    B = np.zeros((Nst, Nin), dtype=dtype)
     B[:Nst01, :Nin01] = SS01.B
     B[Nst01:, Nin01:] = SS02.B
 
     # Build the rest
-    C = np.block([SS01.C, SS02.C])
-    D = np.block([SS01.D, SS02.D])
+    C = np.empty((Nout, Nst), dtype=dtype)
+    C[:, :Nst01] = SS01.C
+    C[:, Nst01:] = SS02.C
+    D = np.empty((Nout, Nin), dtype=dtype)
+    D[:, :Nin01] = SS01.D
+    D[:, Nin01:] = SS02.D
 
     SStot = scsig.dlti(A, B, C, D, dt=SS01.dt)
 
     return SStot
 
 
+def _add_dot(M0, A, B, sparse_prod=False):
+    """
+    Returns M0 + A B, or A B if M0 is None. If all matrices are dense float64
+    arrays, the product and the sum are fused into a single BLAS dgemm call.
+    Otherwise, A B is stored as sparse if A is sparse and sparse_prod is True,
+    as dense if not, whatever the storage of B.
+    """
+
+    if M0 is not None and all(
+            isinstance(M, np.ndarray) and M.ndim == 2 and M.dtype == np.float64
+            for M in (M0, A, B)):
+        return scalg.blas.dgemm(1., A, B, beta=1., c=M0)
+    AB = libsp.dot(A, B)
+    if sparse_prod and isinstance(A, libsp.csc_matrix):
+        if not isinstance(AB, libsp.csc_matrix):
+            AB = libsp.csc_matrix(AB)
+    else:
+        AB = libsp.dense(AB)
+    if M0 is None:
+        return AB
+    return M0 + AB
+
+
 def SSconv(A, B0, B1, C, D, Bm1=None):
     r"""
     Convert a DLTI system with prediction and delay of the form:
@@ -1002,12 +1135,17 @@ def SSconv(A, B0, B1, C, D, Bm1=None):
         functions untested for delays (Bm1 != 0)
     """
 
-    # Account for u^{n+1} terms (prediction)
-    if B0 is None:
-        Bh = libsp.dot(A, B1)
-    else:
-        Bh = B0 + libsp.dot(A, B1)
-    Dh = D + libsp.dot(C, B1)
+    # Account for u^{n+1} terms (prediction). B1 is only used in products, hence
+    # if any sparse matrix is involved, its storage is chosen there according to
+    # its density (with all dense matrices, the products go straight to BLAS).
+    # The products are stored as sparse if both factors were given as sparse,
+    # such that the type of the output matrices does not depend on the density
+    # of B1
+    B1_sparse = isinstance(B1, libsp.csc_matrix)
+    if B1_sparse or isinstance(A, libsp.csc_matrix):
+        B1 = libsp.auto(B1)
+    Bh = _add_dot(B0, A, B1, sparse_prod=B1_sparse)
+    Dh = _add_dot(D, C, B1, sparse_prod=B1_sparse)
 
     # Account for u^{n-1} terms (delay)
     if Bm1 is None:
@@ -1016,10 +1154,17 @@ def SSconv(A, B0, B1, C, D, Bm1=None):
         warnings.warn('Function untested when Bm1!=None')
 
         Nx, Nu, Ny = A.shape[0], Bh.shape[1], C.shape[0]
-        AA = np.block([[A, Bm1],
-                       [np.zeros((Nu, Nx)), np.zeros((Nu, Nu))]])
-        BB = np.block([[Bh], [np.eye(Nu)]])
-        CC = np.block([C, np.zeros((Ny, Nu))])
+        dtype = np.result_type(A.dtype, Bm1.dtype, Bh.dtype, C.dtype)
+
+        # only the non-zero blocks are written
+        AA = np.zeros((Nx + Nu, Nx + Nu), dtype=dtype)
+        AA[:Nx, :Nx] = libsp.dense(A)
+        AA[:Nx, Nx:] = libsp.dense(Bm1).reshape((Nx, Nu))
+        BB = np.zeros((Nx + Nu, Nu), dtype=dtype)
+        BB[:Nx, :] = libsp.dense(Bh)
+        np.fill_diagonal(BB[Nx:, :], 1.)
+        CC = np.zeros((Ny, Nx + Nu), dtype=dtype)
+        CC[:, :Nx] = libsp.dense(C)
         DD = Dh
         outs = (AA, BB, CC, DD)
 
@@ -1048,27 +1193,32 @@ def addGain(SShere, Kmat, where):
 
     if where == 'in':
         A = SShere.A
-        B = SShere.B.dot(Kmat)
+        B = libsp.dot(SShere.B, Kmat)
         C = SShere.C
-        D = SShere.D.dot(Kmat)
+        D = libsp.dot(SShere.D, Kmat)
 
     if where == 'out':
         A = SShere.A
         B = SShere.B
-        C = Kmat.dot(SShere.C)
-        D = Kmat.dot(SShere.D)
-
-    if where == 'parallel-down':
-        A = SShere.A
-        C = SShere.C
-        B = np.block([SShere.B, np.zeros((SShere.B.shape[0], Kmat.shape[1]))])
-        D = np.block([SShere.D, Kmat])
+        C = libsp.dot(Kmat, SShere.C)
+        D = libsp.dot(Kmat, SShere.D)
 
-    if where == 'parallel-up':
+    if where in ['parallel-down', 'parallel-up']:
         A = SShere.A
         C = SShere.C
-        B = np.block([np.zeros((SShere.B.shape[0], Kmat.shape[1])), SShere.B])
-        D = np.block([Kmat, SShere.D])
+        (Nx, Nu), Nk = SShere.B.shape, Kmat.shape[1]
+        B = np.empty((Nx, Nu + Nk), dtype=SShere.B.dtype)
+        D = np.empty((SShere.D.shape[0], Nu + Nk),
+                     dtype=np.result_type(SShere.D.dtype, Kmat.dtype))
+        # columns of the original inputs and of the gain inputs
+        if where == 'parallel-down':
+            ss_cols, k_cols = slice(0, Nu), slice(Nu, Nu + Nk)
+        else:
+            ss_cols, k_cols = slice(Nk, Nu + Nk), slice(0, Nk)
+        B[:, ss_cols] = libsp.dense(SShere.B)
+        B[:, k_cols] = 0.
+        D[:, ss_cols] = libsp.dense(SShere.D)
+        D[:, k_cols] = libsp.dense(Kmat)
 
     if SShere.dt == None:
         SSnew = ss(A, B, C, D)
@@ -1170,6 +1320,52 @@ def join2(SS1, SS2):
 
     return SStot
 
+def block_diag_ss(SS_list):
+    """
+    Block-diagonal join of a list of state-space models (libss.ss) and/or gain
+    matrices (np.ndarray or libsparse.csc_matrix), such that the inputs/outputs of the joined system are
+    the inputs/outputs of each element, stacked in order. This is equivalent to
+    calling join2 recursively, but the system matrices are allocated only once.
+
+    Gain matrices are treated as systems with no states. The output system is
+    dense.
+    """
+
+    # sizes of each element: (states, inputs, outputs)
+    is_gain = [isinstance(SShere, (np.ndarray, libsp.csc_matrix)) for SShere in SS_list]
+    SS_systems = [SShere for SShere, gain in zip(SS_list, is_gain) if not gain]
+    dt = SS_systems[0].dt if SS_systems else None
+    sizes, dtypes = [], []
+    for SShere, gain in zip(SS_list, is_gain):
+        if gain:
+            sizes.append((0, SShere.shape[1], SShere.shape[0]))
+            dtypes.append(SShere.dtype)
+        else:
+            assert SShere.dt == dt, 'State-space models must have the same time-step'
+            sizes.append((SShere.states, SShere.inputs, SShere.outputs))
+            dtypes += [M.dtype for M in SShere.get_mats()]
+    Nx, Nu, Ny = np.sum(sizes, axis=0)
+    dtype = np.result_type(*dtypes)
+
+    A = np.zeros((Nx, Nx), dtype=dtype)
+    B = np.zeros((Nx, Nu), dtype=dtype)
+    C = np.zeros((Ny, Nx), dtype=dtype)
+    D = np.zeros((Ny, Nu), dtype=dtype)
+
+    ix, iu, iy = 0, 0, 0
+    for SShere, gain, (nx, nu, ny) in zip(SS_list, is_gain, sizes):
+        if gain:
+            D[iy:iy + ny, iu:iu + nu] = libsp.dense(SShere)
+        else:
+            A[ix:ix + nx, ix:ix + nx] = libsp.dense(SShere.A)
+            B[ix:ix + nx, iu:iu + nu] = libsp.dense(SShere.B)
+            C[iy:iy + ny, ix:ix + nx] = libsp.dense(SShere.C)
+            D[iy:iy + ny, iu:iu + nu] = libsp.dense(SShere.D)
+        ix, iu, iy = ix + nx, iu + nu, iy + ny
+
+    return ss(A, B, C, D, dt=dt)
+
+
 def join(SS_list,wv=None):
 	'''
 	Given a list of state-space models belonging to the ss class, creates a
@@ -1192,13 +1388,25 @@ def join(SS_list,wv=None):
 	if wv is not None:
 		assert N==len(wv), "'weights input should have'"
 
-	A = scalg.block_diag(*[ getattr(ss,'A') for ss in SS_list ])
-	B = np.block([ [getattr(ss,'B')] for ss in SS_list ])
-
-	if wv is None:
-		C = np.block( [ getattr(ss,'C') for ss in SS_list ] )
-	else:
-		C = np.block( [ ww*getattr(ss,'C') for ww,ss in zip(wv,SS_list) ] )
+	# allocate and fill the joined matrices block by block
+	Nx_list = [ ss.A.shape[0] for ss in SS_list ]
+	Nx = sum(Nx_list)
+	dtype = np.result_type(*[ M for ss in SS_list for M in (ss.A,ss.B,ss.C) ],
+						   *(wv if wv is not None else []))
+	A = np.zeros((Nx,Nx),dtype=dtype)
+	B = np.empty((Nx,SS_list[0].B.shape[1]),dtype=dtype)
+	C = np.empty((SS_list[0].C.shape[0],Nx),dtype=dtype)
+	ix = 0
+	for ii in range(N):
+		ss_here = SS_list[ii]
+		ix_end = ix + Nx_list[ii]
+		A[ix:ix_end,ix:ix_end] = ss_here.A
+		B[ix:ix_end,:] = ss_here.B
+		if wv is None:
+			C[:,ix:ix_end] = ss_here.C
+		else:
+			np.multiply(wv[ii],ss_here.C,out=C[:,ix:ix_end])
+		ix = ix_end
 
 	D=np.zeros_like(SS_list[0].D)
 	for ii in range(N):
@@ -1249,12 +1457,17 @@ def sum_ss(SS1, SS2, negative=False):
         Nin01, Nout01 = SS1.inputs, SS1.outputs
         Nin02, Nout02 = SS2.inputs, SS2.outputs
         Nx01, Nx02 = SS1.A.shape[0], SS2.A.shape[0]
-
-        A = np.block([[SS1.A, np.zeros((Nx01, Nx02))],
-                      [np.zeros((Nx02, Nx01)), SS2.A]])
-        B = np.block([[SS1.B, ],
-                      [SS2.B]])
-        C = np.block([SS1.C, SS2.C])
+        dtype = np.result_type(SS1.A, SS1.B, SS1.C, SS2.A, SS2.B, SS2.C)
+
+        A = np.zeros((Nx01 + Nx02, Nx01 + Nx02), dtype=dtype)
+        A[:Nx01, :Nx01] = SS1.A
+        A[Nx01:, Nx01:] = SS2.A
+        B = np.empty((Nx01 + Nx02, Nin01), dtype=dtype)
+        B[:Nx01, :] = SS1.B
+        B[Nx01:, :] = SS2.B
+        C = np.empty((Nout01, Nx01 + Nx02), dtype=dtype)
+        C[:, :Nx01] = SS1.C
+        C[:, Nx01:] = SS2.C
         D = SS1.D + SS2.D
 
         SStot = scsig.StateSpace(A, B, C, D, dt=SS1.dt)
@@ -1310,51 +1523,50 @@ def scale_SS(SSin, input_scal=1., output_scal=1., state_scal=1., byref=True):
     if isinstance(input_scal, (list, np.ndarray)):
         assert len(input_scal) == Nin, \
             'Length of input_scal not matching number of state-space inputs!'
-    else:
-        input_scal = Nin * [input_scal]
-
     if isinstance(output_scal, (list, np.ndarray)):
         assert len(output_scal) == Nout, \
             'Length of output_scal not matching number of state-space outputs!'
-    else:
-        output_scal = Nout * [output_scal]
-
     if isinstance(state_scal, (list, np.ndarray)):
         assert len(state_scal) == Nstates, \
             'Length of state_scal not matching number of state-space states!'
-    else:
-        state_scal = Nstates * [state_scal]
+    input_scal = np.broadcast_to(np.asarray(input_scal, dtype=float), (Nin,))
+    output_scal = np.broadcast_to(np.asarray(output_scal, dtype=float), (Nout,))
+    state_scal = np.broadcast_to(np.asarray(state_scal, dtype=float), (Nstates,))
 
     if byref:
         SS = SSin
     else:
-        print('deep-copying state-space model before scaling')
-        SS = copy.deepcopy(SSin)
-
-    # update input related matrices
-    for ii in range(Nin):
-        SS.B[:, ii] = SS.B[:, ii] * input_scal[ii]
-        SS.D[:, ii] = SS.D[:, ii] * input_scal[ii]
-        # SS.B[:,ii]*=input_scal[ii]
-        # SS.D[:,ii]*=input_scal[ii]
-
-    # update output related matrices
-    for ii in range(Nout):
-        SS.C[ii, :] = SS.C[ii, :] / output_scal[ii]
-        SS.D[ii, :] = SS.D[ii, :] / output_scal[ii]
-        # SS.C[ii,:]/=output_scal[ii]
-        # SS.D[ii,:]/=output_scal[ii]
-
-    # update state related matrices
-    for ii in range(Nstates):
-        SS.B[ii, :] = SS.B[ii, :] / state_scal[ii]
-        SS.C[:, ii] = SS.C[:, ii] * state_scal[ii]
-        # SS.B[ii,:]/=state_scal[ii]
-        # SS.C[:,ii]*=state_scal[ii]
+        # B, C, D are scaled into new arrays, hence they are excluded from the
+        # deep copy (via the memo) so as not to copy them twice
+        SS = copy.deepcopy(SSin, memo={id(M): M for M in (SSin.B, SSin.C, SSin.D)})
+
+    # scale rows and columns of each matrix in a single vectorised pass
+    SS.B = _scale_rows_cols(SS.B, 1. / state_scal, input_scal, byref)
+    SS.C = _scale_rows_cols(SS.C, 1. / output_scal, state_scal, byref)
+    SS.D = _scale_rows_cols(SS.D, 1. / output_scal, input_scal, byref)
 
     return SS
 
 
+def _scale_rows_cols(M, row_scal, col_scal, byref=True):
+    """
+    Scale the rows and columns of M by the arrays row_scal and col_scal.
+    Dense arrays are scaled through broadcasting, without allocating the full
+    scaling matrix, in place if byref is True, into a new array otherwise.
+    Sparse matrices are always rebuilt.
+    """
+
+    if isinstance(M, np.ndarray):
+        if not byref:
+            M = M * row_scal[:, np.newaxis]
+        else:
+            M *= row_scal[:, np.newaxis]
+        M *= col_scal[np.newaxis, :]
+        return M
+    return libsp.csc_matrix(
+        M.multiply(row_scal[:, np.newaxis]).multiply(col_scal[np.newaxis, :]))
+
+
 def simulate(SShere, U, x0=None):
     """
     Routine to simulate response to generic input.
@@ -1375,6 +1587,27 @@ def simulate(SShere, U, x0=None):
     if len(U.shape) == 1:
         U = U.reshape((NT, 1))
 
+    if isinstance(SShere, ss_packed):
+        # [x_{n+1}; y_n] = M [x_n; u_n]
+        M = SShere.M
+        xu = np.empty((M.shape[1],), dtype=M.dtype)
+        for ii in range(NT):
+            xu[:Nx] = X[ii]
+            xu[Nx:] = U[ii]
+            xy = np.dot(M, xu)
+            Y[ii] = xy[Nx:]
+            if ii < NT - 1:
+                X[ii + 1] = xy[:Nx]
+        return Y, X
+
+    if _simulate_dense is not None and \
+            all([isinstance(M, np.ndarray) and M.ndim == 2 and M.dtype == np.float64
+                 for M in (A, B, C, D)]):
+        _simulate_dense(np.ascontiguousarray(A), np.ascontiguousarray(B),
+                        np.ascontiguousarray(C), np.ascontiguousarray(D),
+                        np.ascontiguousarray(U, dtype=np.float64), X, Y)
+        return Y, X
+
     Y[0] = libsp.dot(C, X[0]) + libsp.dot(D, U[0])
 
     for ii in range(1, NT):
@@ -1384,6 +1617,19 @@ def simulate(SShere, U, x0=None):
     return Y, X
 
 
+if njit is not None:
+    @njit(cache=True)
+    def _simulate_dense(A, B, C, D, U, X, Y):
+        """ Compiled time-stepping of simulate for dense matrices. X[0] is the
+        initial state, X and Y are filled in place. """
+        Y[0] = np.dot(C, X[0]) + np.dot(D, U[0])
+        for ii in range(1, U.shape[0]):
+            X[ii] = np.dot(A, X[ii - 1]) + np.dot(B, U[ii - 1])
+            Y[ii] = np.dot(C, X[ii]) + np.dot(D, U[ii])
+else:
+    _simulate_dense = None
+
+
 def Hnorm_from_freq_resp(gv, method):
     """
     Given a frequency response over a domain kv, this funcion computes the
@@ -1395,16 +1641,17 @@ def Hnorm_from_freq_resp(gv, method):
     Warning: only use for SISO systems! For MIMO definitions are different
     """
 
-    if method is 'H2':
+    if method == 'H2':
         Nk = len(gv)
-        gvsq = gv * gv.conj()
-        Gnorm = np.sqrt(np.trapz(gvsq / (Nk - 1.)))
+        # squared magnitude, computed as a real array
+        gvsq = gv.real * gv.real + gv.imag * gv.imag
+        Gnorm = np.sqrt(np.trapz(gvsq) / (Nk - 1.))
 
-    elif method is 'Hinf':
+    elif method == 'Hinf':
         Gnorm = np.linalg.norm(gv, np.inf)
 
-    if np.abs(Gnorm.imag / Gnorm.real) > 1e-16:
-        raise NameError('Norm is not a real number. Verify data/algorithm!')
+    else:
+        raise NameError('Method %s not recognised!' % method)
 
     return Gnorm
 
@@ -1419,19 +1666,16 @@ def adjust_phase(y, deg=True):
     else:
         shift = 2. * np.pi
 
-    dymax = 0.0
-
-    N = len(y)
-    for ii in range(N - 1):
-        dy = y[ii + 1] - y[ii]
-        if np.abs(dy) > dymax: dymax = np.abs(dy)
-        if dy > 0.97 * shift:
-            print('Subtracting shift to frequency response phase diagram!')
-            y[ii + 1::] = y[ii + 1::] - shift
-
-        elif dy < -0.97 * shift:
-            y[ii + 1::] = y[ii + 1::] + shift
-            print('Adding shift to frequency response phase diagram!')
+    # a shift applied at a jump is carried by all the following entries, hence
+    # the jumps can be detected on the original data and the shifts accumulated
+    dy = np.diff(y)
+    # direction of each jump: +1 (up), -1 (down) or 0
+    dirs = (dy > 0.97 * shift).view(np.int8) - (dy < -0.97 * shift).view(np.int8)
+    if np.any(dirs > 0):
+        print('Subtracting shift to frequency response phase diagram!')
+    if np.any(dirs < 0):
+        print('Adding shift to frequency response phase diagram!')
+    y[1:] -= shift * np.cumsum(dirs)
 
     return y
 
@@ -1510,25 +1754,16 @@ def build_SS_poly(Acf, ds, negative=False):
     assert Ncf == 3, 'Acf input last dimension must be equal to 3!'
 
     Ader, Bder, Cder, Dder = SSderivative(ds)
-    SSder = scsig.dlti(Ader, Bder, Cder, Dder, dt=ds)
-    SSder02 = series(SSder, join2(np.array([[1]]), SSder))
-
-    SSder_all = copy.deepcopy(SSder02)
-    for ii in range(Nin - 1):
-        SSder_all = join2(SSder_all, SSder02)
+    SSder = ss(Ader, Bder, Cder, Dder, dt=ds)
+    SSder02 = series(SSder, block_diag_ss([np.array([[1]]), SSder]))
+    SSder_all = block_diag_ss(Nin * [SSder02])
 
     # Build polynomial forcing terms
     sign = 1.0
     if negative == True: sign = -1.0
 
-    A0 = Acf[:, :, 0]
-    A1 = Acf[:, :, 1]
-    A2 = Acf[:, :, 2]
-    Kforce = np.zeros((Nout, 3 * Nin))
-    for ii in range(Nin):
-        Kforce[:, 3 * ii] = sign * (A0[:, ii])
-        Kforce[:, 3 * ii + 1] = sign * (A1[:, ii])
-        Kforce[:, 3 * ii + 2] = sign * (A2[:, ii])
+    # columns 3*ii, 3*ii+1, 3*ii+2 hold A0[:,ii], A1[:,ii], A2[:,ii]
+    Kforce = sign * Acf.reshape((Nout, 3 * Nin))
     SSpoly_neg = addGain(SSder_all, Kforce, where='out')
 
     return SSpoly_neg
@@ -1549,11 +1784,9 @@ def butter(order, Wn, N=1, btype='lowpass'):
     # build DLTI SISO
     num, den = scsig.butter(order, Wn, btype=btype, analog=False, output='ba')
     Af, Bf, Cf, Df = scsig.tf2ss(num, den)
-    SSf = scsig.dlti(Af, Bf, Cf, Df, dt=1.0)
+    SSf = ss(Af, Bf, Cf, Df, dt=1.0)
 
-    SStot = SSf
-    for ii in range(1, N):
-        SStot = join2(SStot, SSf)
+    SStot = block_diag_ss(N * [SSf])
 
     return SStot.A, SStot.B, SStot.C, SStot.D
 
@@ -1599,12 +1832,16 @@ def eigvals(a, dlti=False):
 # --------------------------------------------------------------------- Testing
 
 
-def random_ss(Nx, Nu, Ny, dt=None, use_sparse=False, stable=True):
+def random_ss(Nx, Nu, Ny, dt=None, use_sparse=False, stable=True, rng=None):
     """
     Define random system from number of states (Nx), inputs (Nu) and output (Ny).
+    The entries are drawn from the random generator rng (e.g. a
+    np.random.Generator) or, if None, from numpy's global random state.
     """
 
-    A = np.random.rand(Nx, Nx)
+    if rng is None:
+        rng = np.random
+    A = rng.random((Nx, Nx))
     if stable:
         ev,U=np.linalg.eig(A)
         evabs=np.abs(ev)
@@ -1613,37 +1850,51 @@ def random_ss(Nx, Nu, Ny, dt=None, use_sparse=False, stable=True):
             if evabs[ee]>0.99:
                 ev[ee]/=1.1*evabs[ee]
         A = np.dot(U*ev, np.linalg.inv(U) ).real
-    B = np.random.rand(Nx, Nu)
-    C = np.random.rand(Ny, Nx)
-    D = np.random.rand(Ny, Nu)
+    B = rng.random((Nx, Nu))
+    C = rng.random((Ny, Nx))
+    D = rng.random((Ny, Nu))
 
+    SS = ss(A, B, C, D, dt=dt)
     if use_sparse:
-        SS = ss(libsp.csc_matrix(A),
-                libsp.csc_matrix(B),
-                libsp.csc_matrix(C),
-                libsp.csc_matrix(D),
-                dt=dt)
-    else:
-        SS = ss(A, B, C, D, dt=dt)
+        SS = ss_to_csc(SS)
 
     return SS
 
 
+def ss_to_csc(SS):
+    """
+    Returns a state-space model with the same matrices of SS stored in
+    libsparse.csc_matrix format.
+    """
+    return ss(*[libsp.csc_matrix(M) for M in SS.get_mats()], dt=SS.dt)
+
+
+def _max_abs_diff(M1, M2):
+    """
+    Maximum absolute difference between the entries of M1 and M2. If both are
+    sparse, the difference is evaluated without densifying them.
+    """
+
+    if isinstance(M1, np.ndarray) or isinstance(M2, np.ndarray):
+        return np.max(np.abs(libsp.dense(M1) - libsp.dense(M2)))
+    return abs(M1 - M2).max()
+
+
 def compare_ss(SS1, SS2, tol=1e-10, Print=False):
     """
     Assert matrices of state-space models are identical
     """
 
-    era = np.max(np.abs(libsp.dense(SS1.A) - libsp.dense(SS2.A)))
+    era = _max_abs_diff(SS1.A, SS2.A)
     if Print: print('Max. error A: %.3e' % era)
 
-    erb = np.max(np.abs(libsp.dense(SS1.B) - libsp.dense(SS2.B)))
+    erb = _max_abs_diff(SS1.B, SS2.B)
     if Print: print('Max. error B: %.3e' % erb)
 
-    erc = np.max(np.abs(libsp.dense(SS1.C) - libsp.dense(SS2.C)))
+    erc = _max_abs_diff(SS1.C, SS2.C)
     if Print: print('Max. error C: %.3e' % erc)
 
-    erd = np.max(np.abs(libsp.dense(SS1.D) - libsp.dense(SS2.D)))
+    erd = _max_abs_diff(SS1.D, SS2.D)
     if Print: print('Max. error D: %.3e' % erd)
 
     assert era < tol, 'Error A matrix %.2e>%.2e' % (era, tol)
@@ -1659,22 +1910,38 @@ def compare_ss(SS1, SS2, tol=1e-10, Print=False):
 
 
 if __name__ == '__main__':
+    import itertools
     import unittest
 
 
     class Test_dlti(unittest.TestCase):
         """ Test methods into this module for DLTI systems """
 
-        def setUp(self):
-            # allocate some state-space model (dense and sparse)
-            dt = 0.3
+        @classmethod
+        def setUpClass(cls):
+            # allocate some state-space model (dense and sparse) once
+            rng = np.random.default_rng(0)
+            cls.dt = 0.3
             Ny, Nx, Nu = 4, 3, 2
-            A = np.random.rand(Nx, Nx)
-            B = np.random.rand(Nx, Nu)
-            C = np.random.rand(Ny, Nx)
-            D = np.random.rand(Ny, Nu)
-            self.SS = ss(A, B, C, D, dt=dt)
-            self.SSsp = ss(libsp.csc_matrix(A), libsp.csc_matrix(B), C, D, dt=dt)
+            cls.mats = (rng.random((Nx, Nx)), rng.random((Nx, Nu)),
+                        rng.random((Ny, Nx)), rng.random((Ny, Nu)))
+            cls.Acsc = libsp.csc_matrix(cls.mats[0])
+            cls.Bcsc = libsp.csc_matrix(cls.mats[1])
+            cls.Dcsc = libsp.csc_matrix(cls.mats[3])
+            # coupling gains for test_couple (not modified by couple)
+            cls.K12 = rng.random((4, 2))
+            cls.K21 = rng.random((3, 2))
+            cls.K12sp = libsp.csc_matrix(cls.K12)
+            cls.K21sp = libsp.csc_matrix(cls.K21)
+
+        def setUp(self):
+            # tests modify the systems in place: work on copies of the fixtures
+            A, B, C, D = [M.copy() for M in self.mats]
+            self.SS = ss(A, B, C, D, dt=self.dt)
+            self.SSsp = ss(self.Acsc.copy(), self.Bcsc.copy(), C.copy(), D.copy(),
+                           dt=self.dt)
+            # each test draws reproducible data, independently of the others
+            self.rng = np.random.default_rng(1)
 
         def test_SSconv(self):
 
@@ -1684,7 +1951,7 @@ if __name__ == '__main__':
             A, B, C, D = SS.get_mats()
 
             # remove predictor: try different scenario
-            B1 = np.random.rand(Nx, Nu)
+            B1 = self.rng.random((Nx, Nu))
             SSpr0 = ss(*SSconv(A, B, B1, C, D), dt=0.3)
             SSpr1 = ss(*SSconv(A, B, libsp.csc_matrix(B1), C, D), dt=0.3)
             SSpr2 = ss(*SSconv(
@@ -1693,10 +1960,13 @@ if __name__ == '__main__':
                 libsp.csc_matrix(A), libsp.csc_matrix(B), B1, C, D), dt=0.3)
             SSpr4 = ss(*SSconv(
                 libsp.csc_matrix(A), libsp.csc_matrix(B), libsp.csc_matrix(B1), C, D), dt=0.3)
-            compare_ss(SSpr0, SSpr1)
-            compare_ss(SSpr0, SSpr2)
-            compare_ss(SSpr0, SSpr3)
-            compare_ss(SSpr0, SSpr4)
+            # output storage does not depend on the density of B1
+            self.assertIs(type(SSpr4.B), libsp.csc_matrix)
+
+            # SSpr0 is dense: only the candidate systems are densified
+            for SSpr in (SSpr1, SSpr2, SSpr3, SSpr4):
+                compare_ss(SSpr0, SSpr)
+            compare_ss(ss_to_csc(SSpr0), ss_to_csc(SSpr4))
 
         def test_scale_SS(self):
 
@@ -1705,12 +1975,17 @@ if __name__ == '__main__':
             Nu, Nx, Ny = SS.inputs, SS.states, SS.outputs
 
             # scale (hard-copy)
-            insc = np.random.rand(Nu)
-            stsc = np.random.rand(Nx)
-            outsc = np.random.rand(Ny)
+            insc = self.rng.random(Nu)
+            stsc = self.rng.random(Nx)
+            outsc = self.rng.random(Ny)
+            SS.tags = ['original']
             SSadim = scale_SS(SS, insc, outsc, stsc, byref=False)
             SSadim_sp = scale_SS(SSsp, insc, outsc, stsc, byref=False)
             compare_ss(SSadim, SSadim_sp)
+            # the copy is independent of the original model
+            compare_ss(SS, ss(*self.mats, dt=self.dt))
+            self.assertIsNot(SSadim.A, SS.A)
+            self.assertIsNot(SSadim.tags, SS.tags)
 
             # scale (by reference)
             SS.scale(insc, outsc, stsc)
@@ -1724,14 +1999,19 @@ if __name__ == '__main__':
             Nu, Nx, Ny = SS.inputs, SS.states, SS.outputs
 
             # add gains
-            Kin = np.random.rand(Nu, 5)
-            Kout = np.random.rand(4, Ny)
+            Kin = self.rng.random((Nu, 5))
+            Kout = self.rng.random((4, Ny))
             SS.addGain(Kin, 'in')
             SS.addGain(Kout, 'out')
             SSsp.addGain(Kin, 'in')
             SSsp.addGain(Kout, 'out')
             compare_ss(SS, SSsp)
 
+            # module function: sparse matrices in products with dense gains
+            SSsp = ss(self.Acsc, self.Bcsc, libsp.csc_matrix(self.mats[2]), self.Dcsc,
+                      dt=self.dt)
+            compare_ss(SS, addGain(addGain(SSsp, Kin, 'in'), Kout, 'out'))
+
         def test_freqresp(self):
             # freq response: try different scenario
 
@@ -1742,48 +2022,148 @@ if __name__ == '__main__':
             kv = np.linspace(0, 1, 8)
             Y = SS.freqresp(kv)
             Ysp = SSsp.freqresp(kv)
-            er = np.max(np.abs(Y - Ysp))
-            assert er < 1e-10, 'Test on freqresp failed'
+            np.testing.assert_allclose(Y, Ysp, rtol=0, atol=1e-10)
+
+            # freqresp does not modify D: the cached sparse copy can be shared
+            SS.D = self.Dcsc
+            np.testing.assert_allclose(SS.freqresp(kv), Y, rtol=0, atol=1e-10)
+
+            # vectorised back-substitution over chunks of 3 frequencies
+            T, U = scalg.schur(SS.A, output='complex')
+            Ych = _freqresp_backsub(
+                T, np.dot(U.conj().T, SS.B), np.dot(SS.C, U), libsp.dense(SS.D),
+                np.exp(1.j * self.dt * kv), np.empty_like(Y), max_workspace=3 * Nx * Nu)
+            np.testing.assert_allclose(Ych, Y, rtol=0, atol=1e-10)
+
+            # fewer frequencies than states: one solve per frequency
+            np.testing.assert_allclose(
+                SS.freqresp(kv[:2]), Y[:, :, :2], rtol=0, atol=1e-10)
+
+            # upper triangular A: no Schur reduction
+            SS.A = np.triu(SS.A)
+            SSsp.A = libsp.csc_matrix(SS.A)
+            for kvhere in (kv, kv[:2]):
+                np.testing.assert_allclose(
+                    SS.freqresp(kvhere), SSsp.freqresp(kvhere), rtol=0, atol=1e-10)
+
+        def test_simulate(self):
+            SS = self.SS
+            SSsp = self.SSsp
+            U = self.rng.random((20, SS.inputs))
+            x0 = self.rng.random(SS.states)
+            Y, X = simulate(SS, U, x0)
+            Ysp, Xsp = simulate(SSsp, U, x0)
+            # states may grow over time if A is unstable: use relative error
+            assert np.max(np.abs(Y - Ysp)) < 1e-10 * np.max(np.abs(Y)), \
+                'Test on simulate failed'
+            assert np.max(np.abs(X - Xsp)) < 1e-10 * np.max(np.abs(X)), \
+                'Test on simulate failed'
+
+        def test_parallel(self):
+            # parallel connection against the sum of the separate responses
+            Nout = 2
+            Nin01, Nin02 = 2, 3
+            Nst01, Nst02 = 4, 2
+            NT = 11
+            SS01 = random_ss(Nst01, Nin01, Nout, dt=.1, rng=self.rng)
+            SS02 = random_ss(Nst02, Nin02, Nout, dt=.1, rng=self.rng)
+            # inputs of each system are views into the total input
+            Utot = np.empty((NT, Nin01 + Nin02))
+            U01, U02 = Utot[:, :Nin01], Utot[:, Nin01:]
+            U01[:] = self.rng.random((NT, Nin01))
+            U02[:] = self.rng.random((NT, Nin02))
+
+            Y01, X01 = simulate(SS01, U01)
+            Y02, X02 = simulate(SS02, U02)
+            Yref = Y01 + Y02
+
+            SStot = parallel(SS01, SS02)
+            Ytot, Xtot = simulate(SStot, Utot)
+            er = np.max(np.abs(Ytot - Yref))
+            er = max(er, np.max(np.abs(Xtot[:, :Nst01] - X01)),
+                     np.max(np.abs(Xtot[:, Nst01:] - X02)))
+            assert er < 1e-12, 'test_parallel error %.3e too large' % er
+
+        def test_connections_dtype(self):
+            # complex systems are not downcast
+            SS1 = random_ss(3, 2, 2, dt=.1, rng=self.rng)
+            SS2 = random_ss(2, 2, 2, dt=.1, rng=self.rng)
+            SS1.A = SS1.A + 1.j * np.eye(3)
+            for SStot in (series(SS1, SS2), parallel(SS1, SS2)):
+                self.assertEqual(SStot.A.dtype, np.complex_)
+                assert np.max(np.abs(SStot.A[:3, :3] - SS1.A)) < 1e-16, \
+                    'test_connections_dtype failed'
+
+        def test_ss_packed(self):
+            SS = self.SS
+            SSpk = ss_packed.from_ss(SS)
+            assert all([M.base is SSpk.M for M in SSpk.get_mats()]), \
+                'ss_packed not using a single buffer'
 
-            SS.D = libsp.csc_matrix(SS.D)
-            Y1 = SS.freqresp(kv)
-            er = np.max(np.abs(Y - Y1))
-            assert er < 1e-10, 'Test on freqresp failed'
+            kv = np.linspace(0, 1, 8)
+            er = np.max(np.abs(SS.freqresp(kv) - SSpk.freqresp(kv)))
+            assert er < 1e-10, 'Test on ss_packed freqresp failed'
+
+            # continuous-time model
+            SS.dt = None
+            SSpk = ss_packed.from_ss(SS)
+            er = np.max(np.abs(SS.freqresp(kv) - SSpk.freqresp(kv)))
+            assert er < 1e-10, 'Test on ss_packed freqresp failed'
+
+            U = self.rng.random((20, SS.inputs))
+            x0 = self.rng.random(SS.states)
+            Y, X = simulate(SS, U, x0)
+            Ypk, Xpk = simulate(SSpk, U, x0)
+            assert np.max(np.abs(Y - Ypk)) < 1e-10 * np.max(np.abs(Y)), \
+                'Test on ss_packed simulate failed'
+            assert np.max(np.abs(X - Xpk)) < 1e-10 * np.max(np.abs(X)), \
+                'Test on ss_packed simulate failed'
+
+        def test_ss_batch(self):
+            SS_list = [random_ss(4, 3, 2, dt=.2, rng=self.rng) for ii in range(3)]
+            SS_list.append(ss_to_csc(SS_list[0]))
+            SSb = ss_batch.from_ss_list(SS_list)
+            kv = np.linspace(0, 1, 5)
+            Yb = SSb.freqresp(kv)
+            self.assertEqual(Yb.shape, (4, 2, 3, 5))
+            for SS, Y in zip(SS_list, Yb):
+                er = np.max(np.abs(Y - SS.freqresp(kv)))
+                assert er < 1e-10, 'test_ss_batch error %.3e too large' % er
 
         def test_couple(self):
             dt = .2
             Nx1, Nu1, Ny1 = 3, 4, 2
             Nx2, Nu2, Ny2 = 4, 3, 2
-            K12 = np.random.rand(Nu1, Ny2)
-            K21 = np.random.rand(Nu2, Ny1)
-            SS1 = random_ss(Nx1, Nu1, Ny1, dt=.2)
-            SS2 = random_ss(Nx2, Nu2, Ny2, dt=.2)
-
-            SS1sp = ss(libsp.csc_matrix(SS1.A),
-                       libsp.csc_matrix(SS1.B),
-                       libsp.csc_matrix(SS1.C),
-                       libsp.csc_matrix(SS1.D), dt=dt)
-            SS2sp = ss(libsp.csc_matrix(SS2.A),
-                       libsp.csc_matrix(SS2.B),
-                       libsp.csc_matrix(SS2.C),
-                       libsp.csc_matrix(SS2.D), dt=dt)
-            K12sp = libsp.csc_matrix(K12)
-            K21sp = libsp.csc_matrix(K21)
-
-            # SCref=couple_full(SS1,SS2,K12,K21)
+            K12, K21, K12sp, K21sp = self.K12, self.K21, self.K12sp, self.K21sp
+            SS1 = random_ss(Nx1, Nu1, Ny1, dt=.2, rng=self.rng)
+            SS2 = random_ss(Nx2, Nu2, Ny2, dt=.2, rng=self.rng)
+
+            SS1sp = ss_to_csc(SS1)
+            SS2sp = ss_to_csc(SS2)
+
+            # couple returns dense systems: compare all dense/sparse combinations
             SC0 = couple(SS1, SS2, K12, K21)
-            # compare_ss(SCref,SC0)
-            for SSa in [SS1, SS1sp]:
-                for SSb in [SS2, SS2sp]:
-                    for k12 in [K12, K12sp]:
-                        for k21 in [K21, K21sp]:
-                            SChere = couple(SSa, SSb, k12, k21)
-                            compare_ss(SC0, SChere)
+            for SSa, SSb, k12, k21 in itertools.product(
+                    (SS1, SS1sp), (SS2, SS2sp), (K12, K12sp), (K21, K21sp)):
+                with self.subTest(SS1_sparse=SSa is SS1sp, SS2_sparse=SSb is SS2sp,
+                                  K12_sparse=k12 is K12sp, K21_sparse=k21 is K21sp):
+                    SChere = couple(SSa, SSb, k12, k21)
+                    for Mhere, M0 in zip(SChere.get_mats(), SC0.get_mats()):
+                        np.testing.assert_allclose(Mhere, M0, rtol=0, atol=1e-10)
+
+            # strictly proper system: compare against general path
+            SS2.D[:] = 1e-20
+            SCref = couple(SS1, SS2, K12, K21)
+            SS2.D[:] = 0.
+            for k12 in [K12, K12sp]:
+                for k21 in [K21, K21sp]:
+                    compare_ss(SCref, couple(SS1, SS2, k12, k21))
+                    compare_ss(SCref, couple(SS1sp, SS2, k12, k21))
 
         def test_join(self):
 
             Nx,Nu,Ny = 4, 3, 2
-            SS_list = [random_ss(Nx,Nu,Ny,dt=.2) for ii in range(3)]
+            SS_list = [random_ss(Nx,Nu,Ny,dt=.2,rng=self.rng) for ii in range(3)]
 
             wv = [.3, .5, .2]
             SSjoin = join(SS_list,wv)
@@ -1798,6 +2178,38 @@ if __name__ == '__main__':
             er = np.max(np.abs(Yjoin - Yref))
             assert er<1e-14, 'test_join error %.3e too large' %er
 
+        def test_block_diag_ss(self):
+
+            SS_list = [random_ss(4, 3, 2, dt=.2, rng=self.rng),
+                       self.rng.random((2, 1)),
+                       random_ss(3, 2, 1, dt=.2, use_sparse=True, rng=self.rng)]
+            SSjoin = block_diag_ss(SS_list)
+            assert (SSjoin.states, SSjoin.inputs, SSjoin.outputs) == (7, 6, 5), \
+                'test_block_diag_ss: wrong size'
+
+            kv = np.array([0., 1., 3.])
+            Yjoin = SSjoin.freqresp(kv)
+            er = np.max(np.abs(Yjoin[:2, :3] - SS_list[0].freqresp(kv)))
+            er = max(er, np.max(np.abs(Yjoin[2:4, 3:4] - SS_list[1][:, :, None])))
+            er = max(er, np.max(np.abs(Yjoin[4:, 4:] - SS_list[2].freqresp(kv))))
+            er = max(er, np.max(np.abs(Yjoin[:2, 3:])), np.max(np.abs(Yjoin[2:, :3])))
+            assert er < 1e-12, 'test_block_diag_ss error %.3e too large' % er
+
+            # sparse gains
+            SS_list[1] = libsp.csc_matrix(SS_list[1])
+            er = np.max(np.abs(block_diag_ss(SS_list).freqresp(kv) - Yjoin))
+            assert er < 1e-12, 'test_block_diag_ss error %.3e too large' % er
+
+            # complex blocks are not downcast
+            SS_list[1] = 1.j * SS_list[1]
+            self.assertEqual(block_diag_ss(SS_list).D.dtype, np.complex_)
+
+            # continuous and discrete-time systems cannot be joined
+            SSct = random_ss(2, 1, 1, rng=self.rng)
+            for SS_mixed in ([SSct, SS_list[0]], [SS_list[0], SSct]):
+                with self.assertRaises(AssertionError):
+                    block_diag_ss(SS_mixed)
+
         def test_disc2cont(self):
             # not the best test given that eigenvalue comparison is not great with random systems. (error grows near
             # nyquist frequency)
@@ -1834,43 +2246,3 @@ def ss_to_scipy(ss):
         sys = scsig.dlti(ss.A, ss.B, ss.C, ss.D, dt=ss.dt)
 
     return sys
-
-# 1/0
-
-# # check parallel connector
-# Nout=2
-# Nin01,Nin02=2,3
-# Nst01,Nst02=4,2
-
-# # build random systems
-# fac=0.1
-# A01,A02=fac*np.random.rand(Nst01,Nst01),fac*np.random.rand(Nst02,Nst02)
-# B01,B02=np.random.rand(Nst01,Nin01),np.random.rand(Nst02,Nin02)
-# C01,C02=np.random.rand(Nout,Nst01),np.random.rand(Nout,Nst02)
-# D01,D02=np.random.rand(Nout,Nin01),np.random.rand(Nout,Nin02)
-
-# dt=0.1
-# SS01=scsig.StateSpace( A01,B01,C01,D01,dt=dt )
-# SS02=scsig.StateSpace( A02,B02,C02,D02,dt=dt )
-
-# # simulate
-# NT=11
-# U01,U02=np.random.rand(NT,Nin01),np.random.rand(NT,Nin02)
-
-# # reference
-# Y01,X01=simulate(SS01,U01)
-# Y02,X02=simulate(SS02,U02)
-# Yref=Y01+Y02
-
-# # parallel
-# SStot=parallel(SS01,SS02)
-# Utot=np.block([U01,U02])
-# Ytot,Xtot=simulate(SStot,Utot)
-
-# # join method
-# SStot=join(SS01,SS02)
-# K=np.array([[1,2,3],[4,5,6]])
-# SStot=join(K,SS02)
-# SStot=join(SS02,K)
-# K2=np.array([[10,20,30],[40,50,60]]).T
-# Ktot=join(K,K2)